@@ -19,7 +19,7 @@
     # Check https://github.com/odoo/odoo/blob/15.0/odoo/addons/base/data/ir_module_category_data.xml
     # for the full list
     'category': 'Customisation',
-    'version': '17.0.0.0.7',
+    'version': '17.0.0.0.11',
 
     # any module necessary for this one to work correctly
     'depends': ['purchase_stock', 'sale_stock', 'delivery'],
@@ -33,6 +33,9 @@
         'views/stock_picking_views.xml',
         'views/res_config_settings_views.xml',
         'views/delivery_view.xml',
+        'views/payload_archive_views.xml',
+        'views/operation_stat_views.xml',
+        'views/ongoing_job_views.xml',
         'data/cron.xml',
     ],
     'license': 'OEEL-1',
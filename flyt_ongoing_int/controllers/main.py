@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from datetime import timedelta
+
+from odoo import fields, http
+from odoo.http import request
+from odoo.tools import consteq
+
+from ..models.ongoing_metrics import PHASES
+
+# Quantiles are computed over the periods of the last METRICS_WINDOW minutes
+METRICS_WINDOW = 15
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class OngoingMetrics(http.Controller):
+
+    def _labels(self, companies, company_id, operation, **extra):
+        labels = dict(company=companies.get(company_id, ''), operation=operation, **extra)
+        return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for key, value in labels.items())
+
+    @http.route('/ongoing/metrics', type='http', auth='public', methods=['GET'], csrf=False, save_session=False)
+    def metrics(self, token=None, window=None, **kwargs):
+        """ Ongoing call statistics in the Prometheus text format.
+
+            Counters are summed over the stored periods of every worker;
+            quantiles are estimated from the merged histograms of the last
+            `window` minutes. The endpoint is disabled unless the
+            flyt_ongoing_int.metrics_token system parameter is set, and the
+            token must be given as ?token= or a bearer Authorization header.
+        """
+        expected = request.env['ir.config_parameter'].sudo().get_param('flyt_ongoing_int.metrics_token')
+        token = token or request.httprequest.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not expected or not consteq(expected, token or ''):
+            return request.not_found()
+
+        Stat = request.env['ongoing.operation.stat'].sudo()
+        companies = dict(request.env['res.company'].sudo().search([]).mapped(lambda c: (c.id, c.name)))
+        window = int(window) if window and window.isdigit() else METRICS_WINDOW
+        lines = []
+
+        lines += ['# HELP ongoing_calls_total Ongoing SOAP calls by outcome',
+                  '# TYPE ongoing_calls_total counter']
+        totals = Stat._totals()
+        for company_id, operation, calls, successes, failures, faults, errors, *dummy in totals:
+            for outcome, count in (('success', successes), ('failure', failures), ('fault', faults), ('error', errors)):
+                lines.append('ongoing_calls_total{%s} %d' % (
+                    self._labels(companies, company_id, operation, outcome=outcome), count or 0))
+        for name, index, help in (('ongoing_request_bytes_total', 7, 'Bytes sent to Ongoing'),
+                                  ('ongoing_response_bytes_total', 8, 'Bytes received from Ongoing')):
+            lines += ['# HELP %s %s' % (name, help), '# TYPE %s counter' % name]
+            for row in totals:
+                lines.append('%s{%s} %d' % (name, self._labels(companies, row[0], row[1]), row[index] or 0))
+
+        lines += ['# HELP ongoing_call_seconds Ongoing SOAP call duration by phase',
+                  '# TYPE ongoing_call_seconds summary']
+        since = fields.Datetime.now() - timedelta(minutes=window)
+        for (company_id, operation), phases in sorted(Stat._merged_histograms(since).items(), key=str):
+            for phase in PHASES:
+                histogram = phases[phase]
+                for quantile in QUANTILES:
+                    lines.append('ongoing_call_seconds{%s} %.6f' % (
+                        self._labels(companies, company_id, operation, phase=phase, quantile=quantile),
+                        histogram.quantile(quantile)))
+        for row in totals:
+            sums, counts = row[9:9 + len(PHASES)], row[9 + len(PHASES):]
+            for phase, total, count in zip(PHASES, sums, counts):
+                labels = self._labels(companies, row[0], row[1], phase=phase)
+                lines.append('ongoing_call_seconds_sum{%s} %.6f' % (labels, total or 0.0))
+                lines.append('ongoing_call_seconds_count{%s} %d' % (labels, count or 0))
+
+        return request.make_response('\n'.join(lines) + '\n', headers=[
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+        ])
@@ -3,6 +3,7 @@
 
 from . import ongoing_wms_request
 from . import ongoing
+from . import ongoing_line
 from . import purchase
 from . import stock_picking
 from . import res_company
@@ -12,4 +13,8 @@ from . import delivery_carrier
 from . import stock_move
 from . import stock_move_line
 from . import product_product
-from . import processed_line
\ No newline at end of file
+from . import processed_line
+from . import article_fingerprint
+from . import payload_archive
+from . import operation_stat
+from . import ongoing_job
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import hashlib
+import json
+import logging
+from psycopg2.extras import execute_values
+
+from odoo import models, api, fields
+
+_logger = logging.getLogger(__name__)
+
+# Article pushes skipped (hits) and sent (misses) by this worker
+ARTICLE_SYNC_STATS = {'hits': 0, 'misses': 0}
+
+
+class OngoingArticleFingerprint(models.Model):
+    _name = 'ongoing.article.fingerprint'
+    _description = 'Fingerprint of the last article definition sent to Ongoing'
+
+    _sql_constraints = [
+        ('ongoing_article_fingerprint_uniq', 'unique (product_id, company_id)', "One fingerprint per product and company."),
+    ]
+
+    product_id = fields.Many2one('product.product', required=True, ondelete='cascade', index=True)
+    company_id = fields.Many2one('res.company', required=True, ondelete='cascade')
+    fingerprint = fields.Char(required=True)
+    last_sync = fields.Datetime()
+
+    @api.model
+    def _compute_fingerprint(self, data):
+        payload = json.dumps(data, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    @api.model
+    def _filter_changed_articles(self, company, datas, force=False):
+        """ Return the article datas that must be sent to Ongoing: one per
+            product, without the ones whose definition was already sent as is
+            @param datas: list of dict with a product_id key
+            @param force: resend every product, even when unchanged
+        """
+        by_product = {}
+        for data in datas:
+            # Later lines win, as they did when every line was sent
+            by_product[data['product_id']] = data
+        if force:
+            changed = list(by_product.values())
+        else:
+            known = dict(self.sudo().search([
+                ('company_id', '=', company.id),
+                ('product_id', 'in', list(by_product)),
+            ]).mapped(lambda fp: (fp.product_id.id, fp.fingerprint)))
+            changed = [data for product_id, data in by_product.items()
+                       if known.get(product_id) != self._compute_fingerprint(data)]
+
+        ARTICLE_SYNC_STATS['hits'] += len(datas) - len(changed)
+        ARTICLE_SYNC_STATS['misses'] += len(changed)
+        _logger.info('Ongoing: %s of %s article lines to send (worker total: %s skipped, %s sent)',
+                     len(changed), len(datas), ARTICLE_SYNC_STATS['hits'], ARTICLE_SYNC_STATS['misses'])
+        return changed
+
+    @api.model
+    def _store_articles(self, company, datas):
+        """ Remember the article definitions that were sent to Ongoing """
+        if not datas:
+            return
+        now = fields.Datetime.now()
+        uid = self.env.uid
+        # Upsert, so concurrent confirmations of orders sharing a product don't collide
+        execute_values(self.env.cr._obj, """
+            INSERT INTO ongoing_article_fingerprint
+                (product_id, company_id, fingerprint, last_sync, create_uid, create_date, write_uid, write_date)
+            VALUES %s
+            ON CONFLICT (product_id, company_id) DO UPDATE
+               SET fingerprint = EXCLUDED.fingerprint,
+                   last_sync = EXCLUDED.last_sync,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+        """, [(data['product_id'], company.id, self._compute_fingerprint(data), now, uid, now, uid, now)
+              for data in datas])
+        self.invalidate_model(['fingerprint', 'last_sync'])
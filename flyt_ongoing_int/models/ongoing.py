@@ -2,10 +2,12 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
 import logging
-import psycopg2
-from odoo import models, api, fields, registry, SUPERUSER_ID, _
+from odoo import models, fields, _
 from odoo.exceptions import UserError
-from .ongoing_wms_request import OngoingRequest
+from .ongoing_cassette import get_cassette_client
+from .ongoing_log_writer import get_log_writer
+from .ongoing_wms_request import OngoingRequest, get_company_client
+from .payload_archive import parse_operation_rates
 
 _logger = logging.getLogger(__name__)
 
@@ -17,7 +19,7 @@ class OngoingLoggerMixing(models.AbstractModel):
     last_sync_on = fields.Datetime(tracking=True)
 
     def _get_ongoing_credential(self):
-        company = self.company_id or self.env.company
+        company = self.company_id[:1] or self.env.company
         url = company.ongoing_url
         username = company.ongoing_username
         password = company.ongoing_password
@@ -25,24 +27,64 @@ class OngoingLoggerMixing(models.AbstractModel):
         
         return url, username, password, good_owner_code
 
+    def _get_ongoing_transport_options(self):
+        company = self.company_id[:1] or self.env.company
+        return (company.ongoing_pool_size or 1,
+                company.ongoing_connect_timeout or 5.0,
+                company.ongoing_read_timeout or 60.0)
+
+    def _get_ongoing_archive_options(self):
+        company = self.company_id[:1] or self.env.company
+        if not company.ongoing_archive_payloads:
+            return None
+        return (company.ongoing_archive_success_rate,
+                parse_operation_rates(company.ongoing_archive_operation_rates))
+
+    def _is_ongoing_bulk(self, count):
+        """ Whether a batch of count out orders or articles is large enough
+            for the bulk mode of the company """
+        company = self.company_id[:1] or self.env.company
+        return bool(company.ongoing_bulk_threshold) and count >= company.ongoing_bulk_threshold
+
+    def _get_ongoing_request(self, bulk=False):
+        """ Return an OngoingRequest for the current company. The underlying
+            zeep client and its HTTP session are reused by this worker for as
+            long as the company credentials stay the same.
+
+            A bulk request is meant for large batches (see _is_ongoing_bulk):
+            it renders compiled envelopes and runs up to
+            ongoing_bulk_concurrency calls in parallel.
+
+            For performance runs, the exchanges can be recorded (anonymized)
+            to a cassette file with the ongoing_cassette_record context key,
+            and served back from one without calling Ongoing with
+            ongoing_cassette_replay (ongoing_cassette_realtime to keep the
+            recorded latencies), e.g.:
+            pickings.with_context(ongoing_cassette_replay='/tmp/tracking.cassette')._set_tracking_number()
+        """
+        company = self.company_id[:1] or self.env.company
+        credentials = self._get_ongoing_credential()
+        if not credentials[0]:
+            # Let OngoingRequest raise its configuration error
+            return OngoingRequest(self.log_xml, *credentials)
+        client = get_company_client(self._cr.dbname, company.id, credentials,
+                                    self._get_ongoing_transport_options(),
+                                    log_traffic=company.ongoing_log_traffic,
+                                    archive_options=self._get_ongoing_archive_options())
+        context = self.env.context
+        if context.get('ongoing_cassette_record') or context.get('ongoing_cassette_replay'):
+            client = get_cassette_client(client, record=context.get('ongoing_cassette_record'),
+                                         replay=context.get('ongoing_cassette_replay'),
+                                         realtime=context.get('ongoing_cassette_realtime', False),
+                                         transport_options=self._get_ongoing_transport_options())
+        return OngoingRequest(self.log_xml, *credentials, client=client,
+                              max_concurrency=(bulk and company.ongoing_bulk_concurrency)
+                                              or company.ongoing_max_concurrency or 1,
+                              compiled_envelopes=bulk or company.ongoing_compiled_envelopes,
+                              metrics_key=(self._cr.dbname, company.id))
+
     def log_xml(self, xml_string, func):
-        self.flush()
-        db_name = self._cr.dbname
-        # Use a new cursor to avoid rollback that could be caused by an upper method
-        try:
-            db_registry = registry(db_name)
-            with db_registry.cursor() as cr:
-                env = api.Environment(cr, SUPERUSER_ID, {})
-                IrLogging = env['ir.logging']
-                IrLogging.sudo().create({
-                    'name': 'ongoing.wms',
-                    'type': 'server',
-                    'dbname': db_name,
-                    'level': 'DEBUG',
-                    'message': xml_string,
-                    'path': 'ongoing',
-                    'func': func,
-                    'line': 1
-                })
-        except psycopg2.Error:
-            pass
+        """ Queue xml_string for ir.logging. It is written by a background
+            thread on its own cursor, so it survives a rollback of the
+            current transaction and costs no database round trip here. """
+        get_log_writer(self._cr.dbname).log(xml_string, func)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import collections
+import gzip
+import hashlib
+import io
+import json
+import logging
+import re
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from zeep.transports import Transport
+
+from .ongoing_wms_request import OngoingTransport
+from .ongoing_wsdl import CachedClient
+
+_logger = logging.getLogger(__name__)
+
+# Elements whose content is replaced by *** in cassettes
+SECRET_TAGS = ('Password', 'UserName', 'GoodsOwnerCode')
+# Elements holding personal data, replaced by a stable pseudonym so that
+# equal values stay equal across the cassette
+PERSONAL_TAGS = ('Name', 'CustomerName', 'Address', 'Address1', 'Address2', 'Address3', 'PostCode', 'City',
+                 'TelePhone', 'Telephone', 'Mobile', 'MobilePhone', 'Email', 'Remark', 'OrderRemark',
+                 'DeliveryInstruction', 'ConsigneeOrderNumber', 'ContactPerson', 'Comment')
+
+
+def _element_re(tags):
+    return re.compile(rb'(<(?:[\w-]+:)?(?:%s)(?:\s[^>]*)?>)([^<]+)(</)' % b'|'.join(tag.encode() for tag in tags))
+
+
+SECRET_RE = _element_re(SECRET_TAGS)
+PERSONAL_RE = _element_re(PERSONAL_TAGS)
+
+
+def _pseudonym(match):
+    digest = hashlib.sha1(match.group(2)).hexdigest()[:10]
+    return match.group(1) + b'anon-' + digest.encode() + match.group(3)
+
+
+def anonymize(body):
+    """ body (bytes) without credentials and personal data """
+    body = SECRET_RE.sub(rb'\1***\3', body)
+    return PERSONAL_RE.sub(_pseudonym, body)
+
+
+def _operation(headers):
+    return (headers.get('SOAPAction') or '').strip('"').rsplit('/', 1)[-1]
+
+
+class Cassette():
+    """ Recorded Ongoing exchanges, stored as gzipped JSON lines.
+
+        Each exchange is appended as its own gzip member as soon as it is
+        recorded, so a cassette stays readable if the recording stops
+        abruptly. The recorded exchanges are loaded once and shared by the
+        replays of the cassette, each serving them back from the start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def record(self, operation, request, response, latency):
+        entry = json.dumps({
+            'operation': operation,
+            'latency': round(latency, 6),
+            'status': response.status_code,
+            'content_type': response.headers.get('Content-Type', 'text/xml; charset=utf-8'),
+            'request': anonymize(request).decode('utf-8', 'replace'),
+            'response': anonymize(response.content).decode('utf-8', 'replace'),
+        })
+        with self._lock:
+            with gzip.open(self.path, 'at', encoding='utf-8') as cassette_file:
+                cassette_file.write(entry + '\n')
+            self._entries = None
+
+    def _load(self):
+        entries = collections.defaultdict(list)
+        with gzip.open(self.path, 'rt', encoding='utf-8') as cassette_file:
+            for line in cassette_file:
+                entry = json.loads(line)
+                entries[entry['operation']].append(entry)
+        return entries
+
+    def entries(self, operation):
+        """ Recorded exchanges of operation, in recording order """
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return self._entries.get(operation, ())
+
+
+class RecordingTransport(OngoingTransport):
+    """ OngoingTransport saving every exchange to a cassette """
+
+    def __init__(self, cassette, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cassette = cassette
+
+    def post(self, address, message, headers):
+        started = time.monotonic()
+        response = super().post(address, message, headers)
+        self.cassette.record(_operation(headers), message, response, time.monotonic() - started)
+        return response
+
+    def post_stream(self, address, message, headers):
+        started = time.monotonic()
+        response = super().post_stream(address, message, headers)
+        # The body has to be read to be recorded, serve it back from memory
+        content = response.content
+        self.cassette.record(_operation(headers), message, response, time.monotonic() - started)
+        response.raw = io.BytesIO(content)
+        return response
+
+
+class ReplayTransport(Transport):
+    """ zeep transport answering from a cassette instead of the network.
+        Each transport is a replay session of its own: it serves the
+        exchanges of every operation from the first one recorded, and the
+        requests sharing it (e.g. run_batch threads) share its position.
+        @param realtime: wait as long as the recorded exchange took
+        @param loop: serve the recorded exchanges again once all are used
+    """
+
+    def __init__(self, cassette, realtime=False, loop=True):
+        super().__init__()
+        self.cassette = cassette
+        self.realtime = realtime
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._positions = collections.Counter()
+
+    def _next_entry(self, operation):
+        """ Next recorded exchange of operation, None once they are all
+            served (unless loop, which starts over) """
+        entries = self.cassette.entries(operation)
+        with self._lock:
+            position = self._positions[operation]
+            if not entries or (position >= len(entries) and not self.loop):
+                return None
+            self._positions[operation] = position + 1
+        return entries[position % len(entries)]
+
+    def _replay(self, address, headers):
+        operation = _operation(headers)
+        entry = self._next_entry(operation)
+        if entry is None:
+            raise requests.ConnectionError('Ongoing: no recorded %s exchange left in %s'
+                                           % (operation, self.cassette.path))
+        if self.realtime:
+            time.sleep(entry['latency'])
+        content = entry['response'].encode('utf-8')
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict({'Content-Type': entry['content_type']})
+        response.url = address
+        response._content = content
+        response.raw = io.BytesIO(content)
+        return response
+
+    def post(self, address, message, headers):
+        return self._replay(address, headers)
+
+    def post_stream(self, address, message, headers):
+        return self._replay(address, headers)
+
+
+_cassettes_lock = threading.Lock()
+# path -> Cassette, so that a cassette is loaded once and written by one lock
+_cassettes = {}
+# (path, transport options) -> RecordingTransport, reusing its HTTP session
+# like the company clients do
+_recording_transports = {}
+
+
+def get_cassette(path):
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = _cassettes[path] = Cassette(path)
+        return cassette
+
+
+def _get_recording_transport(path, transport_options):
+    cassette = get_cassette(path)
+    key = (path, tuple(transport_options))
+    with _cassettes_lock:
+        transport = _recording_transports.get(key)
+        if transport is None:
+            transport = _recording_transports[key] = RecordingTransport(cassette, *transport_options)
+        return transport
+
+
+def get_cassette_client(client, record=None, replay=None, realtime=False, transport_options=()):
+    """ Copy of client recording its exchanges to the cassette at path
+        record, through a transport with the company transport_options (see
+        get_company_client), or replaying them from the cassette at path
+        replay, from its first exchanges """
+    if record:
+        transport = _get_recording_transport(record, transport_options)
+    else:
+        transport = ReplayTransport(get_cassette(replay), realtime=realtime)
+    return CachedClient(client.wsdl, client.service._binding_options['address'],
+                        transport=transport, plugins=client.plugins)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+from datetime import timedelta
+from psycopg2.extras import execute_values
+
+from odoo import models, api, fields, _
+
+_logger = logging.getLogger(__name__)
+
+# Jobs claimed by one worker run
+JOB_BATCH_SIZE = 50
+# Attempts before a job is given up as failed
+JOB_MAX_ATTEMPTS = 8
+# Seconds before the first retry, doubled after each failed attempt
+JOB_BACKOFF = 60
+JOB_BACKOFF_MAX = 6 * 3600
+# Running jobs not finished after this many minutes belong to a dead worker
+JOB_STALE_MINUTES = 60
+JOB_RETENTION_DAYS = 30
+
+
+class OngoingJob(models.Model):
+    _name = 'ongoing.job'
+    _description = 'Ongoing synchronization job'
+    _order = 'priority, next_try, id'
+
+    job_type = fields.Selection([
+        ('out_order', 'Send out order'),
+        ('in_order', 'Send in order'),
+        ('out_order_update', 'Update out order'),
+    ], required=True)
+    picking_id = fields.Many2one('stock.picking', required=True, ondelete='cascade', index=True)
+    company_id = fields.Many2one('res.company', required=True, ondelete='cascade')
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], required=True, default='pending')
+    priority = fields.Integer(default=10, help='Lower runs first')
+    attempts = fields.Integer()
+    next_try = fields.Datetime(required=True, default=fields.Datetime.now)
+    started_on = fields.Datetime()
+    dedupe_key = fields.Char(required=True, help='A job is not enqueued again while one with the same key is '
+                                                 'pending or running')
+    last_error = fields.Text()
+
+    def init(self):
+        super().init()
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ongoing_job_dedupe_key_active_index
+                ON ongoing_job (dedupe_key)
+             WHERE state IN ('pending', 'running')
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS ongoing_job_pending_index
+                ON ongoing_job (priority, next_try, id)
+             WHERE state = 'pending'
+        """)
+
+    # --------------------------
+    # Enqueueing
+    # --------------------------
+
+    @api.model
+    def _enqueue(self, job_type, pickings, priority=10):
+        """ Queue a job_type job for every picking, unless one is already
+            pending or running for it. The jobs are inserted in the current
+            transaction, so they only exist if it commits. """
+        pickings = pickings.filtered(lambda p: p.company_id.activate_ongoing)
+        if not pickings:
+            return
+        now = fields.Datetime.now()
+        uid = self.env.uid
+        execute_values(self.env.cr._obj, """
+            INSERT INTO ongoing_job
+                (job_type, picking_id, company_id, state, priority, attempts, next_try, dedupe_key,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES %s
+            ON CONFLICT (dedupe_key) WHERE state IN ('pending', 'running') DO NOTHING
+        """, [(job_type, picking.id, picking.company_id.id, 'pending', priority, 0, now,
+               '%s:%s' % (job_type, picking.id), uid, now, uid, now) for picking in pickings])
+        self.invalidate_model()
+        worker = self.env.ref('flyt_ongoing_int.ir_cron_ongoing_job_worker', raise_if_not_found=False)
+        if worker:
+            worker._trigger()
+
+    # --------------------------
+    # Worker
+    # --------------------------
+
+    @api.model
+    def _cron_process(self, batch_size=JOB_BATCH_SIZE):
+        """ Claim up to batch_size due jobs and run them.
+
+            Jobs are claimed with FOR UPDATE SKIP LOCKED and marked running
+            in a short transaction of their own, so several workers can drain
+            the queue side by side without ever taking the same job.
+        """
+        cr = self.env.cr
+        cr.execute("""
+            UPDATE ongoing_job
+               SET state = 'pending'
+             WHERE state = 'running'
+               AND started_on < (NOW() at time zone 'UTC') - %s * interval '1 minute'
+        """, [JOB_STALE_MINUTES])
+        if cr.rowcount:
+            _logger.warning('Ongoing: requeued %s jobs of a stopped worker', cr.rowcount)
+        cr.execute("""
+            UPDATE ongoing_job
+               SET state = 'running', attempts = attempts + 1,
+                   started_on = NOW() at time zone 'UTC', write_date = NOW() at time zone 'UTC'
+             WHERE id IN (
+                SELECT id
+                  FROM ongoing_job
+                 WHERE state = 'pending' AND next_try <= NOW() at time zone 'UTC'
+              ORDER BY priority, next_try, id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+             )
+         RETURNING id
+        """, [batch_size])
+        jobs = self.browse([row[0] for row in cr.fetchall()])
+        cr.commit()
+        self.invalidate_model()
+        if not jobs:
+            return True
+        _logger.info('Ongoing: running %s jobs', len(jobs))
+
+        jobs.filtered(lambda j: j.job_type == 'out_order')._run_out_orders()
+        for job in jobs.filtered(lambda j: j.job_type == 'in_order'):
+            job._run_picking_method('action_sync_in_order')
+        for job in jobs.filtered(lambda j: j.job_type == 'out_order_update'):
+            job._run_picking_method('_push_ongoing_order_changes')
+        if len(jobs) == batch_size:
+            # More may be due, don't wait for the next scheduled run
+            self.env.ref('flyt_ongoing_int.ir_cron_ongoing_job_worker')._trigger()
+        return True
+
+    def _run_out_orders(self):
+        Picking = self.env['stock.picking']
+        for company in self.company_id:
+            jobs = self.filtered(lambda j: j.company_id == company)
+            try:
+                ready, skipped = Picking._get_pickings_to_send(jobs.picking_id.ids)
+                errors = ready.with_company(company)._dispatch_out_orders() if ready else {}
+            except Exception as e:
+                # The orders sent before the failure are committed already,
+                # their jobs are done at the retry
+                _logger.exception('Ongoing: out_order jobs of %s failed :: %s', company.name, e)
+                self.env.cr.rollback()
+                for job in jobs:
+                    job._finish(str(e))
+                continue
+            for job in jobs:
+                picking = job.picking_id
+                if picking.id in errors:
+                    job._finish(errors[picking.id])
+                elif picking in ready or picking.ongoing_order_id:
+                    job._finish()
+                else:
+                    # Not assigned anymore or not fully reserved: it is queued
+                    # again when its reservation changes
+                    job._finish(note=_('Not ready to be sent to Ongoing'))
+
+    def _run_picking_method(self, method_name):
+        """ Run the job by calling method_name on its picking, which raises
+            when the job has to be retried """
+        picking = self.picking_id.with_company(self.company_id)
+        error = False
+        try:
+            with self.env.cr.savepoint():
+                getattr(picking, method_name)()
+        except Exception as e:
+            _logger.exception('Ongoing: %s job of %s failed :: %s', self.job_type, picking.name, e)
+            error = str(e)
+        self._finish(error)
+
+    def _finish(self, error=False, note=False):
+        """ Mark the job done, or schedule its retry with an exponential
+            backoff on error, and commit """
+        if not error:
+            self.write({'state': 'done', 'last_error': note})
+        elif self.attempts >= JOB_MAX_ATTEMPTS:
+            _logger.error('Ongoing: giving up %s job of %s after %s attempts :: %s',
+                          self.job_type, self.picking_id.name, self.attempts, error)
+            self.write({'state': 'failed', 'last_error': error})
+        else:
+            delay = min(JOB_BACKOFF * 2 ** max(self.attempts - 1, 0), JOB_BACKOFF_MAX)
+            self.write({
+                'state': 'pending',
+                'next_try': fields.Datetime.now() + timedelta(seconds=delay),
+                'last_error': error,
+            })
+        self.env.cr.commit()
+
+    def action_retry(self):
+        """ Run failed jobs again, with a fresh set of attempts """
+        self.filtered(lambda j: j.state == 'failed').write({
+            'state': 'pending',
+            'attempts': 0,
+            'next_try': fields.Datetime.now(),
+        })
+        self.env.ref('flyt_ongoing_int.ir_cron_ongoing_job_worker')._trigger()
+        return True
+
+    @api.model
+    def _cron_purge(self):
+        self.env.cr.execute("""
+            DELETE FROM ongoing_job
+             WHERE state IN ('done', 'failed')
+               AND write_date < (NOW() at time zone 'UTC') - %s * interval '1 day'
+        """, [JOB_RETENTION_DAYS])
+        _logger.info('Ongoing: purged %s finished jobs', self.env.cr.rowcount)
+        self.invalidate_model()
+        return True
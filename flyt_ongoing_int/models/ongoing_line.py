@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+from psycopg2 import IntegrityError
+
+from odoo import models, fields
+
+_logger = logging.getLogger(__name__)
+
+# Shared by stock.move and stock.move.line, so a number identifies a single
+# record of either. It starts above the random numbers (0-999) used before.
+LINE_NUMBER_SEQUENCE = 'ongoing_line_number_seq'
+LINE_NUMBER_START = 1000000
+
+
+class OngoingLineMixin(models.AbstractModel):
+    _name = 'ongoing.line.mixin'
+    _description = 'Ongoing order line number'
+
+    ongoing_line_number = fields.Char('Line number', tracking=True, copy=False,
+                                      help='ExternalOrderLineCode of the line in Ongoing')
+
+    def init(self):
+        super().init()
+        if self._abstract:
+            return
+        cr = self.env.cr
+        cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {LINE_NUMBER_SEQUENCE} START {LINE_NUMBER_START}")
+        try:
+            with cr.savepoint(flush=False):
+                cr.execute(f"""
+                    CREATE UNIQUE INDEX IF NOT EXISTS {self._table}_ongoing_line_number_uniq
+                        ON {self._table} (ongoing_line_number)
+                     WHERE ongoing_line_number IS NOT NULL
+                """)
+        except IntegrityError:
+            # Numbers assigned at random before collide: keep them searchable
+            _logger.warning('Ongoing: duplicated line numbers in %s, indexing them without a unique constraint',
+                            self._table)
+            cr.execute(f"""
+                CREATE INDEX IF NOT EXISTS {self._table}_ongoing_line_number_index
+                    ON {self._table} (ongoing_line_number)
+                 WHERE ongoing_line_number IS NOT NULL
+            """)
+
+    def _assign_ongoing_line_numbers(self):
+        """ Number the lines that have no line number yet, in one query """
+        lines = self.filtered(lambda line: not line.ongoing_line_number)
+        if not lines:
+            return
+        lines.flush_recordset(['ongoing_line_number'])
+        self.env.cr.execute(f"""
+            UPDATE {self._table}
+               SET ongoing_line_number = nextval('{LINE_NUMBER_SEQUENCE}')::varchar
+             WHERE id IN %s AND ongoing_line_number IS NULL
+        """, [tuple(lines.ids)])
+        lines.invalidate_recordset(['ongoing_line_number'])
+        _logger.debug('Ongoing: numbered %s %s records', len(lines), self._name)
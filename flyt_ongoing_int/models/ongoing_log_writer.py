@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import atexit
+import logging
+import queue
+import threading
+
+from psycopg2.extras import execute_values
+
+from odoo import registry
+
+_logger = logging.getLogger(__name__)
+
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 200
+# Seconds a record may wait in the queue before its batch is written anyway
+LOG_FLUSH_INTERVAL = 2.0
+
+_lock = threading.Lock()
+# (writer class, dbname) -> writer
+_writers = {}
+
+
+class LogWriter():
+    """ Writes Ongoing traffic to ir_logging from a background thread.
+
+        log() only appends to a bounded in-memory queue, so logging costs
+        neither a cursor nor a commit to the caller. The writer thread drains
+        the queue in batches of LOG_BATCH_SIZE rows, each written with a
+        single INSERT on its own cursor. When the queue is full the record is
+        dropped and counted rather than blocking the caller.
+
+        Subclasses write to other tables by overriding _query, _template and
+        _rows.
+    """
+    _query = """
+        INSERT INTO ir_logging (create_date, type, dbname, name, level, message, path, line, func)
+        VALUES %s
+    """
+    _template = "(NOW() at time zone 'UTC', 'server', %s, 'ongoing.wms', 'DEBUG', %s, 'ongoing', '1', %s)"
+
+    def __init__(self, dbname, maxsize=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE, interval=LOG_FLUSH_INTERVAL):
+        self.dbname = dbname
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue(maxsize)
+        self._stats_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name='ongoing.log.%s' % dbname, daemon=True)
+        self._thread.start()
+
+    def log(self, *record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queued': self._queue.qsize(),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+    def _next_batch(self, timeout):
+        """ Block up to timeout for a first record, then take what is
+            already queued, up to batch_size records. None means stop. """
+        try:
+            first = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        batch = [first]
+        while first is not None and len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        running = True
+        while running:
+            batch = self._next_batch(self.interval)
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+            if batch:
+                self._write(batch)
+
+    def _rows(self, batch):
+        return [(self.dbname, message, func) for message, func in batch]
+
+    def _write(self, batch):
+        try:
+            with registry(self.dbname).cursor() as cr:
+                execute_values(cr._obj, self._query, self._rows(batch),
+                               template=self._template, page_size=self.batch_size)
+            with self._stats_lock:
+                self.written += len(batch)
+        except Exception as e:
+            # Never let the writer thread die, logging would silently stop
+            with self._stats_lock:
+                self.failed += len(batch)
+            _logger.warning('Ongoing: unable to write %s log records: %s', len(batch), e)
+
+    def close(self, timeout=10.0):
+        """ Stop the writer thread once everything queued so far is written """
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+
+def get_log_writer(dbname, writer_class=LogWriter):
+    """ Return the writer_class writer of this worker for dbname """
+    with _lock:
+        writer = _writers.get((writer_class, dbname))
+        if writer is None:
+            writer = _writers[(writer_class, dbname)] = writer_class(dbname)
+        return writer
+
+
+@atexit.register
+def close_log_writers():
+    """ Flush the pending log records when the worker shuts down """
+    with _lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import atexit
+import bisect
+import json
+import threading
+import time
+
+from odoo import SUPERUSER_ID
+from .ongoing_log_writer import LogWriter, get_log_writer
+
+# Upper bounds (seconds) of the latency histogram buckets, the last one is +Inf
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+# build: payload preparation, serialize: envelope rendering, network: HTTP
+# round trip, parse: response deserialization, total: all of them
+PHASES = ('build', 'serialize', 'network', 'parse', 'total')
+OUTCOMES = ('success', 'failure', 'fault', 'error')
+# Seconds of calls aggregated in memory before they are flushed as stat rows
+STATS_FLUSH_INTERVAL = 60
+
+_lock = threading.Lock()
+# dbname -> OperationMetrics
+_metrics = {}
+
+
+class Histogram():
+    """ Latency histogram on the fixed BUCKETS bounds """
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts else [0] * len(BUCKETS)
+        self.count = sum(self.counts)
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """ Estimate the q quantile, interpolating linearly inside the bucket
+            it falls in, like Prometheus' histogram_quantile() """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                if index == len(BUCKETS) - 1:
+                    # Unbounded bucket: the best known value is the max
+                    return max(lower, self.max)
+                return lower + (BUCKETS[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+
+class OperationStats():
+    """ Calls of one operation for one company """
+    __slots__ = ('phases', 'outcomes', 'request_bytes', 'response_bytes')
+
+    def __init__(self):
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+
+class OperationMetrics():
+    """ Per database call metrics of this worker.
+
+        Calls are aggregated in memory, per (company, operation), over
+        windows of STATS_FLUSH_INTERVAL seconds. A window is handed to the
+        background StatWriter once it is over, so the stat rows of every
+        worker can be queried and merged from the database.
+    """
+
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self._lock = threading.Lock()
+        self._window = {}
+        self._window_start = time.time()
+
+    def record(self, company_id, operation, phases, outcome, request_bytes=0, response_bytes=0):
+        with self._lock:
+            stats = self._window.get((company_id, operation))
+            if stats is None:
+                stats = self._window[(company_id, operation)] = OperationStats()
+            for phase, duration in phases.items():
+                stats.phases[phase].observe(duration)
+            stats.outcomes[outcome] += 1
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+            if time.time() - self._window_start < STATS_FLUSH_INTERVAL:
+                return
+            window, start = self._swap()
+        self._flush(window, start)
+
+    def _swap(self):
+        window, start = self._window, self._window_start
+        self._window, self._window_start = {}, time.time()
+        return window, start
+
+    def flush(self):
+        with self._lock:
+            window, start = self._swap()
+        self._flush(window, start)
+
+    def _flush(self, window, start):
+        writer = get_log_writer(self.dbname, StatWriter)
+        for (company_id, operation), stats in window.items():
+            writer.log(company_id, operation, start, stats)
+
+
+class StatWriter(LogWriter):
+    """ Background batched writer of ongoing_operation_stat rows """
+    _query = """
+        INSERT INTO ongoing_operation_stat
+            (create_uid, create_date, write_uid, write_date, period_start, period_end, company_id, operation,
+             calls, successes, failures, faults, errors, request_bytes, response_bytes,
+             build_sum, build_p50, build_p99, build_count, serialize_sum, serialize_p50, serialize_p99,
+             serialize_count, network_sum, network_p50, network_p99, network_count,
+             parse_sum, parse_p50, parse_p99, parse_count, total_sum, total_p50, total_p99, total_max, histograms)
+        VALUES %s
+    """
+    _template = ("(%s, NOW() at time zone 'UTC', %s, NOW() at time zone 'UTC', "
+                 "to_timestamp(%s) at time zone 'UTC', NOW() at time zone 'UTC', "
+                 + ', '.join(['%s'] * 30) + ")")
+
+    def _rows(self, batch):
+        rows = []
+        for company_id, operation, start, stats in batch:
+            row = [SUPERUSER_ID, SUPERUSER_ID, start, company_id, operation, stats.phases['total'].count]
+            row += [stats.outcomes[outcome] for outcome in OUTCOMES]
+            row += [stats.request_bytes, stats.response_bytes]
+            for phase in PHASES:
+                histogram = stats.phases[phase]
+                row += [histogram.sum, histogram.quantile(0.5), histogram.quantile(0.99)]
+                if phase != 'total':
+                    # Calls failing early never reach the later phases
+                    row.append(histogram.count)
+            row.append(stats.phases['total'].max)
+            row.append(json.dumps({phase: histogram.counts for phase, histogram in stats.phases.items()}))
+            rows.append(tuple(row))
+        return rows
+
+
+def get_metrics(dbname):
+    with _lock:
+        metrics = _metrics.get(dbname)
+        if metrics is None:
+            metrics = _metrics[dbname] = OperationMetrics(dbname)
+        return metrics
+
+
+def record_call(metrics_key, operation, phases, outcome, request_bytes=0, response_bytes=0):
+    """ Record one SOAP call
+        @param metrics_key: (dbname, company id), calls without one are not recorded
+        @param phases: dict phase -> seconds, see PHASES
+        @param outcome: one of OUTCOMES
+    """
+    if not metrics_key:
+        return
+    dbname, company_id = metrics_key
+    get_metrics(dbname).record(company_id, operation, phases, outcome, request_bytes, response_bytes)
+
+
+@atexit.register
+def flush_metrics():
+    """ Hand the current windows to the stat writers before they are
+        closed, atexit handlers running in reverse registration order """
+    with _lock:
+        metrics = list(_metrics.values())
+    for operation_metrics in metrics:
+        operation_metrics.flush()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import hashlib
+import json
+from decimal import Decimal
+
+from lxml import etree
+
+TNS = '{http://ongoingsystems.se/WSI}'
+XSI_NIL = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+# OrderStatusText of a shipped order
+SHIPPED_STATUS = 'Sendt'
+
+
+def _bool(text):
+    return text in ('true', '1')
+
+
+def _value(parent, name, convert=None):
+    """ Value of the child element name of parent, None when absent, empty or nil """
+    if parent is None:
+        return None
+    child = parent.find(TNS + name)
+    if child is None or child.text is None or child.get(XSI_NIL) == 'true':
+        return None
+    return convert(child.text) if convert else child.text
+
+
+def _array(parent, name, item_name, compact):
+    """ Items of an ArrayOf* child, shaped like zeep's serialized objects:
+        None when the array is absent, {item_name: [...]} otherwise """
+    array = parent.find(TNS + name)
+    if array is None:
+        return None
+    return {item_name: [compact(item) for item in array.iterchildren(TNS + item_name)]}
+
+
+def _compact_article(parent):
+    article = parent.find(TNS + 'Article')
+    if article is None:
+        return None
+    return {
+        'SystemId': _value(article, 'SystemId', int),
+        'Name': _value(article, 'Name'),
+        'ArticleNumber': _value(article, 'ArticleNumber'),
+    }
+
+
+def _compact_pallet_item(item):
+    tracking = item.find(TNS + 'Tracking')
+    return {
+        'Id': _value(item, 'Id', int),
+        'LabelId': _value(item, 'LabelId'),
+        'IsTaPalletItem': _value(item, 'IsTaPalletItem', _bool),
+        'Tracking': tracking is not None and {'TrackingUrl': _value(tracking, 'TrackingUrl')} or None,
+    }
+
+
+def _compact_picked_article(item):
+    return {
+        'Article': _compact_article(item),
+        'Serial': _value(item, 'Serial'),
+        'NumberOfItems': _value(item, 'NumberOfItems', Decimal),
+        'OrderLineSystemId': _value(item, 'OrderLineSystemId', int),
+        'ReturnCauseName': _value(item, 'ReturnCauseName'),
+    }
+
+
+def _compact_picked_line(line):
+    return {
+        'Article': _compact_article(line),
+        'ExternalOrderLineCode': _value(line, 'ExternalOrderLineCode'),
+        'ReturnedNumberOfItems': _value(line, 'ReturnedNumberOfItems', Decimal),
+        'OrderLineSystemId': _value(line, 'OrderLineSystemId', int),
+    }
+
+
+def compact_order(order):
+    """ The parts of an Order element the connector uses: status, pallet
+        items and their tracking, picked articles and picked (returned) lines.
+        Keys and nesting follow zeep's serialized Order, so the result can be
+        used wherever a serialized Order was. """
+    info = order.find(TNS + 'OrderInfo')
+    return {
+        'OrderInfo': {
+            'OrderId': _value(info, 'OrderId', int),
+            'OrderStatusText': _value(info, 'OrderStatusText'),
+        },
+        'OrderPalletItems': _array(order, 'OrderPalletItems', 'OrderPalletItemInfo', _compact_pallet_item),
+        'PickedArticleItems': _array(order, 'PickedArticleItems', 'PickedArticleItem', _compact_picked_article),
+        'PickedOrderLines': _array(order, 'PickedOrderLines', 'PickedOrderLine', _compact_picked_line),
+    }
+
+
+def iter_orders(source):
+    """ Yield a compact_order() for each Order of a GetOrdersByQuery response
+        read from source (a file-like object), one at a time: parsed elements
+        are released as soon as they are converted, so memory does not grow
+        with the size of the response. """
+    for dummy, order in etree.iterparse(source, events=('end',), tag=TNS + 'Order'):
+        if order.get(XSI_NIL) != 'true':
+            yield compact_order(order)
+        order.clear()
+        parent = order.getparent()
+        while order.getprevious() is not None:
+            del parent[0]
+
+
+class ReturnLine():
+    """ Returned quantity of a picked order line """
+    __slots__ = ('article', 'line_code', 'quantity', 'line_system_id', 'cause')
+
+    def __init__(self, article, line_code, quantity, line_system_id, cause=None):
+        self.article = article
+        self.line_code = line_code
+        self.quantity = quantity
+        self.line_system_id = line_system_id
+        self.cause = cause
+
+    def __repr__(self):
+        return 'ReturnLine(%r, %r, %r)' % (self.line_code, self.quantity, self.cause)
+
+
+class OrderState():
+    """ What the connector uses of an Ongoing order: status, tracking, collo
+        count, picked serials and returned lines. Slots keep the records
+        small, as a poll can hold thousands of them. """
+    __slots__ = ('order_id', 'status', 'tracking', 'tracking_urls', 'collo_count', 'serials', 'returns')
+
+    def __init__(self, order_id, status=None, tracking=None, tracking_urls=(), collo_count=0, serials=(),
+                 returns=()):
+        self.order_id = order_id
+        self.status = status
+        # LabelId of the last TA pallet item
+        self.tracking = tracking
+        self.tracking_urls = tracking_urls
+        self.collo_count = collo_count
+        # dicts with default_code, serial and done_qty
+        self.serials = serials
+        self.returns = returns
+
+    def __repr__(self):
+        return 'OrderState(%r, %r)' % (self.order_id, self.status)
+
+    @property
+    def shipped(self):
+        return self.status == SHIPPED_STATUS
+
+    @classmethod
+    def from_order(cls, order):
+        """ State of a compact_order(), read in a single pass """
+        info = order['OrderInfo']
+        state = cls(info['OrderId'], info['OrderStatusText'])
+        picked_articles = order['PickedArticleItems'] and order['PickedArticleItems']['PickedArticleItem'] or []
+
+        if state.shipped and order['OrderPalletItems']:
+            pallet_items = order['OrderPalletItems']['OrderPalletItemInfo']
+            state.collo_count = len(pallet_items)
+            tracking_urls = []
+            for pallet_item in pallet_items:
+                if not pallet_item['IsTaPalletItem']:
+                    continue
+                state.tracking = pallet_item['LabelId'] or ''
+                tracking_urls.append(pallet_item['Tracking'] and pallet_item['Tracking']['TrackingUrl'])
+            state.tracking_urls = tuple(tracking_urls)
+
+        if state.shipped and picked_articles:
+            state.serials = tuple({
+                'default_code': item['Article']['ArticleNumber'],
+                'serial': item['Serial'],
+                'done_qty': int(item['NumberOfItems']),
+            } for item in picked_articles)
+
+        if order['PickedOrderLines']:
+            causes = {}
+            for item in picked_articles:
+                if item['ReturnCauseName']:
+                    causes.setdefault(item['OrderLineSystemId'], item['ReturnCauseName'])
+            state.returns = tuple(
+                ReturnLine(line['Article'], line['ExternalOrderLineCode'], line['ReturnedNumberOfItems'],
+                           line['OrderLineSystemId'], causes.get(line['OrderLineSystemId']))
+                for line in order['PickedOrderLines']['PickedOrderLine'])
+        return state
+
+    def tracking_fingerprint(self):
+        """ Hash of the tracking data, see ongoing_tracking_hash of stock.picking """
+        snapshot = {
+            'status': self.status,
+            'tracking': self.tracking,
+            'tracking_url': list(self.tracking_urls) or None,
+            'goods_info': self.collo_count,
+            'serial': sorted(json.dumps(serial, sort_keys=True, default=str) for serial in self.serials),
+        }
+        return hashlib.sha1(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()
+
+
+def index_order_states(orders):
+    """ order id -> OrderState of each compact_order() of orders, which can
+        be a stream: every order is released once its state is read """
+    return {state.order_id: state for state in map(OrderState.from_order, orders)}
@@ -1,30 +1,137 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import copy
+import functools
+import json
 import logging
 import requests
+import threading
+import time
+from types import MappingProxyType
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, date
-from zeep import Client, Plugin, Settings
+from zeep import Plugin, Settings, plugins
 from zeep.exceptions import Fault
+from zeep.transports import Transport
 from zeep.wsdl.utils import etree_to_string
+from zeep.xsd.valueobjects import CompoundValue
 
 from odoo import _
 from odoo.exceptions import ValidationError
 from odoo.modules.module import get_resource_path
 from odoo.tools import remove_accents
-import random
+from .ongoing_envelope import get_envelope_builder
+from .ongoing_log_writer import get_log_writer
+from .ongoing_metrics import record_call
+from .ongoing_order_stream import index_order_states, iter_orders
+from .ongoing_wsdl import get_client
+from .payload_archive import PASSWORD_RE, ArchivePlugin, get_archive_plugin
 
 
 _logger = logging.getLogger(__name__)
 
+# Constant parts of the payloads, shared read-only by every compiled envelope
+VAT_CODE_VALUES = MappingProxyType({
+    'VatCodeOperation': 'Find',
+    'VatCodeIdentification': 'VatPercent',
+    'VatPercent': '25',
+})
+TERMS_OF_DELIVERY_VALUES = MappingProxyType({
+    'TypeOperation': 'Find',
+    'TypeIdentification': 'Name',
+    'Name': 'Standard',
+})
+
+_clients_lock = threading.Lock()
+# (dbname, company id) -> (credentials, zeep client) kept for the worker lifetime
+_clients = {}
+
+
+class OngoingTransport(Transport):
+    """ zeep transport on a pooled keep-alive session with explicit
+        timeouts, recording the latency of every SOAP call """
+
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=60.0):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        super().__init__(session=session, timeout=connect_timeout + read_timeout,
+                         operation_timeout=(connect_timeout, read_timeout))
+        self._stats_lock = threading.Lock()
+        self.call_count = 0
+        self.total_latency = 0.0
+        self.last_latency = None
+
+    def post(self, address, message, headers):
+        started = time.monotonic()
+        try:
+            return super().post(address, message, headers)
+        finally:
+            latency = time.monotonic() - started
+            with self._stats_lock:
+                self.call_count += 1
+                self.total_latency += latency
+                self.last_latency = latency
+            _logger.debug('Ongoing: %s answered in %.3fs', headers.get('SOAPAction', address), latency)
+
+    def post_stream(self, address, message, headers):
+        """ Post message and return the response without reading its body,
+            which can then be consumed incrementally from response.raw.
+            The recorded latency is the time to the response headers. """
+        started = time.monotonic()
+        try:
+            response = self.session.post(address, data=message, headers=headers,
+                                         timeout=self.operation_timeout, stream=True)
+        finally:
+            latency = time.monotonic() - started
+            with self._stats_lock:
+                self.call_count += 1
+                self.total_latency += latency
+                self.last_latency = latency
+        # Let urllib3 undo any gzip/deflate content encoding while streaming
+        response.raw.decode_content = True
+        return response
+
+
+def get_company_client(dbname, company_id, credentials, transport_options=(), log_traffic=False,
+                       archive_options=None):
+    """ Return the zeep client of this worker for a company, building a new
+        one when the credentials or transport options differ from the ones it
+        was built with. With log_traffic, every envelope sent and received is
+        handed to the background log writer of the database. archive_options,
+        (success rate, per operation rates), enables the payload archive. """
+    key = (dbname, company_id)
+    config = (credentials, transport_options, log_traffic, archive_options)
+    with _clients_lock:
+        cached = _clients.get(key)
+        if cached and cached[0] == config:
+            return cached[1]
+        client_plugins = [LogPlugin(get_log_writer(dbname).log)] if log_traffic else []
+        if archive_options:
+            client_plugins.append(get_archive_plugin(dbname, company_id, *archive_options))
+        client = get_client(credentials[0], transport=OngoingTransport(*transport_options), plugins=client_plugins)
+        _clients[key] = (config, client)
+        return client
+
+
+def invalidate_company_clients(dbname, company_ids=None):
+    """ Drop the cached clients of the given companies (all when None) """
+    with _clients_lock:
+        for key in list(_clients):
+            if key[0] == dbname and (company_ids is None or key[1] in company_ids):
+                del _clients[key]
+
+
 class LogPlugin(Plugin):
     """ Small plugin for zeep that catches out/ingoing XML requests and logs them"""
     def __init__(self, debug_logger):
         self.debug_logger = debug_logger
 
     def egress(self, envelope, http_headers, operation, binding_options):
-        self.debug_logger(etree_to_string(envelope).decode(), 'ongoing_request')
+        self.debug_logger(PASSWORD_RE.sub(rb'\1***\2', etree_to_string(envelope)).decode(), 'ongoing_request')
         return envelope, http_headers
 
     def ingress(self, envelope, http_headers, operation):
@@ -35,27 +142,273 @@ class LogPlugin(Plugin):
         context.envelope = context.envelope.prune()
 
 
+def measured(method):
+    """ Mark the start of the build phase of the SOAP call made by method,
+        see OngoingRequest._send """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._build_started = time.perf_counter()
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
 class OngoingRequest():
     """ Low-level object intended to interface Odoo recordsets with Ongoing,
         through appropriate SOAP requests """
 
-    def __init__(self, debug_logger, url, username, password, good_owner_code):
+    def __init__(self, debug_logger, url, username, password, good_owner_code, client=None, max_concurrency=1,
+                 compiled_envelopes=False, metrics_key=None):
         self.debug_logger = debug_logger
+        # (dbname, company id) the call metrics are recorded under
+        self.metrics_key = metrics_key
+        self._build_started = None
         self.username = username
         self.password = password
         self.good_owner_code = good_owner_code
+        self.max_concurrency = max_concurrency
+        self.compiled_envelopes = compiled_envelopes
 
         if not url:
             raise ValidationError(_('Must configure API URL for Ongoing WMS'))
 
-
-        self.client = Client(url)
+        self.client = client or get_client(url, transport=OngoingTransport())
         self.factory = self.client.type_factory("ns0")
+        # zeep Supplier objects by supplier payload, see _prepare_supplier
+        self._supplier_cache = {}
+
+    def run_batch(self, method_name, payloads, return_exceptions=False):
+        """ Call method_name once per payload, with at most max_concurrency
+            calls in flight, and return the formatted responses in payload
+            order.
+
+            The calls run in worker threads, so payloads must be plain data:
+            recordsets cannot be used outside of the calling thread.
+
+            With return_exceptions, a call that raises gives its exception in
+            place of its response instead of failing the whole batch.
+        """
+        payloads = list(payloads)
+        workers = min(self.max_concurrency, len(payloads))
+        if workers <= 1:
+            return [self._batch_call(method_name, payload, return_exceptions) for payload in payloads]
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ongoing') as executor:
+            # Each call stores its raw answer on self.response, so give it its own copy
+            return list(executor.map(
+                lambda payload: copy.copy(self)._batch_call(method_name, payload, return_exceptions), payloads))
+
+    def iter_batch(self, method_name, payloads, return_exceptions=False):
+        """ Same as run_batch, but yield (payload, response) pairs as soon
+            as each call completes, so the caller can use the first responses
+            while the next calls are still in flight """
+        payloads = list(payloads)
+        workers = min(self.max_concurrency, len(payloads))
+        if workers <= 1:
+            for payload in payloads:
+                yield payload, self._batch_call(method_name, payload, return_exceptions)
+            return
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ongoing') as executor:
+            futures = {
+                executor.submit(copy.copy(self)._batch_call, method_name, payload, return_exceptions): payload
+                for payload in payloads
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _batch_call(self, method_name, payload, return_exceptions):
+        try:
+            return getattr(self, method_name)(payload)
+        except Exception as error:
+            if not return_exceptions:
+                raise
+            return error
+
+    # --------------------------
+    # Compiled envelopes
+    # --------------------------
+    # ProcessArticle, ProcessInOrder and ProcessOrder payloads are described
+    # by *_values methods returning plain dicts. The zeep path copies them on
+    # factory objects (_zeep_object), the compiled path renders them directly
+    # with the EnvelopeBuilder, so both send the same envelope.
+
+    def _process_builders(self, operation_name):
+        """ operation -> (body parameter, zeep builder, plain values builder) """
+        return {
+            'ProcessArticle': ('art', self._prepare_article_definition, self._article_definition_values),
+            'ProcessInOrder': ('co', self._prepare_inorder_defination, self._inorder_values),
+            'ProcessOrder': ('co', lambda data: self._zeep_customer_order(self._customer_order_values(data)),
+                             self._customer_order_values),
+        }[operation_name]
+
+    def _zeep_object(self, type_name, values):
+        zeep_object = getattr(self.factory, type_name)()
+        for key, value in values.items():
+            setattr(zeep_object, key, value)
+        return zeep_object
+
+    def _credential_values(self):
+        return {
+            'GoodsOwnerCode': self.good_owner_code,
+            'UserName': self.username,
+            'Password': self.password,
+        }
+
+    def prepare_process_payload(self, operation_name, data):
+        """ Body of a Process* operation for data: a zeep object or plain
+            values depending on compiled_envelopes. It holds no recordset, so
+            it can be sent from a worker thread with _send_process. """
+        param, zeep_builder, values_builder = self._process_builders(operation_name)
+        return values_builder(data) if self.compiled_envelopes else zeep_builder(data)
+
+    def _call_process(self, operation_name, data):
+        """ Send a Process* operation for data, through zeep or through the
+            compiled envelope builder depending on compiled_envelopes """
+        return self._send_process(operation_name, self.prepare_process_payload(operation_name, data))
+
+    def _send_process(self, operation_name, payload):
+        """ Send a Process* operation for a payload of prepare_process_payload """
+        param = self._process_builders(operation_name)[0]
+        return self._call_values(operation_name, **{param: payload})
+
+    def _call_values(self, operation_name, **values):
+        """ Call operation_name with the credentials and values, through zeep
+            or through the compiled envelope builder depending on
+            compiled_envelopes. Only plain values (dicts) can be compiled. """
+        values = dict(self._credential_values(), **values)
+        if not self.compiled_envelopes:
+            return self._call(operation_name, **values)
+
+        serialize_started = time.perf_counter()
+        envelope = get_envelope_builder(self.client.wsdl).build(operation_name, values)
+        return self._post_envelope(operation_name, envelope, serialize_started)
+
+    # --------------------------
+    # Sending
+    # --------------------------
+    # Every SOAP call goes through _send, which does what zeep's
+    # service.<operation>() does (render, post, parse) one step at a time so
+    # each phase can be timed: build (payload preparation, from the
+    # @measured method entry), serialize, network and parse.
+
+    def _call(self, operation_name, **kwargs):
+        """ Equivalent of self.client.service.<operation_name>(**kwargs) """
+        service = self.client.service
+        serialize_started = time.perf_counter()
+        envelope, http_headers = service._binding._create(
+            operation_name, (), kwargs, client=self.client, options=service._binding_options)
+        return self._send(operation_name, envelope, http_headers, serialize_started)
+
+    def _post_envelope(self, operation_name, envelope, serialize_started=None):
+        """ Send a ready envelope the way zeep's binding would """
+        service = self.client.service
+        operation = service._binding.get(operation_name)
+        http_headers = {
+            'SOAPAction': '"%s"' % operation.soapaction,
+            'Content-Type': 'text/xml; charset=utf-8',
+        }
+        envelope, http_headers = plugins.apply_egress(
+            self.client, envelope, http_headers, operation, service._binding_options)
+        return self._send(operation_name, envelope, http_headers, serialize_started or time.perf_counter())
+
+    def _archive_plugin(self):
+        return next((plugin for plugin in self.client.plugins if isinstance(plugin, ArchivePlugin)), None)
+
+    def _archive_failure(self, operation_name, error):
+        """ Archive a call that failed before its response reached the
+            plugins' ingress, when the payload archive is enabled """
+        archive_plugin = self._archive_plugin()
+        if archive_plugin:
+            archive_plugin.failed(operation_name, error)
+
+    def _send(self, operation_name, envelope, http_headers, serialize_started):
+        service = self.client.service
+        binding = service._binding
+        build_started, self._build_started = self._build_started or serialize_started, None
+        phases = {'build': serialize_started - build_started}
+        outcome, request_bytes, response_bytes = 'error', 0, 0
+        try:
+            message = etree_to_string(envelope)
+            request_bytes = len(message)
+            network_started = time.perf_counter()
+            phases['serialize'] = network_started - serialize_started
+            response = self.client.transport.post(service._binding_options['address'], message, http_headers)
+            response_bytes = len(response.content)
+            parse_started = time.perf_counter()
+            phases['network'] = parse_started - network_started
+            outcome = 'fault'
+            result = binding.process_reply(self.client, binding.get(operation_name), response)
+            phases['parse'] = time.perf_counter() - parse_started
+            outcome = 'success'
+            if isinstance(result, CompoundValue) and 'Success' in result and result.Success is False:
+                outcome = 'failure'
+            return result
+        except Exception as error:
+            # SOAP faults already went through the plugins' ingress
+            if not isinstance(error, Fault):
+                self._archive_failure(operation_name, error)
+            raise
+        finally:
+            phases['total'] = time.perf_counter() - build_started
+            record_call(self.metrics_key, operation_name, phases, outcome, request_bytes, response_bytes)
+
+    def compare_envelopes(self, operation_name, data, repeat=1):
+        """ Render operation_name for data with zeep and with the compiled
+            builder, without sending anything.
+
+            Meant for checking the compiled mode and benchmarking it, from an
+            Odoo shell for instance.
+            @return: dict with 'identical' and the mean seconds per build of
+                     each path ('zeep', 'compiled')
+        """
+        param, zeep_builder, values_builder = self._process_builders(operation_name)
+        operation = self.client.service._binding.get(operation_name)
+        builder = get_envelope_builder(self.client.wsdl)
+
+        started = time.perf_counter()
+        for dummy in range(repeat):
+            expected = operation.create(**self._credential_values(), **{param: zeep_builder(data)}).content
+            expected = etree_to_string(expected)
+        zeep_time = (time.perf_counter() - started) / repeat
+
+        started = time.perf_counter()
+        for dummy in range(repeat):
+            envelope = builder.build(operation_name, dict(self._credential_values(), **{param: values_builder(data)}))
+            envelope = etree_to_string(envelope)
+        compiled_time = (time.perf_counter() - started) / repeat
+
+        if envelope != expected:
+            _logger.warning('Ongoing: compiled %s envelope differs from zeep:\n%s\n%s',
+                            operation_name, expected.decode(), envelope.decode())
+        return {
+            'identical': envelope == expected,
+            'zeep': zeep_time,
+            'compiled': compiled_time,
+        }
 
     # --------------------------
         # Sync Products
     # --------------------------
 
+    def _article_definition_values(self, data):
+        values = {
+            'ArticleNumber': data.get('default_code'),
+            'ArticleName': data.get('name'),
+            'BarCode': data.get('barcode'),
+            'PurchasePrice': data.get('price'),
+            'ArticleUnitCode': data.get('uom'),
+            'ArticleOperation': 'CreateOrUpdate',
+            'ArticleIdentification': 'ArticleNumber',
+        }
+        if data.get('supplier'):
+            values['MainSupplier'] = self._supplier_values(data.get('supplier'))
+        if data.get('alternate_suppliers'):
+            values['AlternativeSuppliers'] = {
+                'AlternativeSupplier': [{'Supplier': self._supplier_values(supp)}
+                                        for supp in data.get('alternate_suppliers')],
+            }
+        return values
+
     def _prepare_article_definition(self, data):
         ArticleDefinition = self.factory.ArticleDefinition()
         ArticleDefinition.ArticleNumber = data.get('default_code')
@@ -76,6 +429,7 @@ class OngoingRequest():
                 data.get('alternate_suppliers')))
         return ArticleDefinition
 
+    @measured
     def process_article(self, data):
         formatted_response = {
             'error_message': False,
@@ -87,12 +441,7 @@ class OngoingRequest():
             'message': False,
         }
         try:
-            self.response = self.client.service.ProcessArticle(
-                GoodsOwnerCode=self.good_owner_code,
-                UserName=self.username,
-                Password=self.password,
-                art=self._prepare_article_definition(data),
-            )
+            self.response = self._call_process('ProcessArticle', data)
             _logger.debug(self.response)
             if 'ErrorMessage' in self.response:
                 formatted_response['error_message'] = self.response.ErrorMessage
@@ -118,6 +467,7 @@ class OngoingRequest():
         # Sync In Order
     # --------------------------
 
+    @measured
     def process_inorder(self, data):
         formatted_response = {
             'error_message': False,
@@ -129,12 +479,7 @@ class OngoingRequest():
             'message': False,
         }
         try:
-            self.response = self.client.service.ProcessInOrder(
-                GoodsOwnerCode=self.good_owner_code,
-                UserName=self.username,
-                Password=self.password,
-                co=self._prepare_inorder_defination(data),
-            )
+            self.response = self._call_process('ProcessInOrder', data)
             _logger.debug(self.response)
             if 'ErrorMessage' in self.response:
                 formatted_response['error_message'] = self.response.ErrorMessage
@@ -156,15 +501,18 @@ class OngoingRequest():
             formatted_response['errors_message'] = "Ongoing Server Not Found"
         return formatted_response
 
+    def _orderinfo_values(self, data):
+        return {
+            'InOrderIdentification': 'GoodsOwnerOrderNumber',
+            'InOrderOperation': 'CreateOrUpdate',
+            'ReferenceNumber': data['reference'],
+            'GoodsOwnerOrderNumber': data['order_number'],
+            'OrderDate': data['order_date'],
+            'InDate': data['in_date'],
+        }
+
     def _prepare_orderinfo(self, data):
-        InOrderInfo = self.factory.InOrderInfoClass()
-        InOrderInfo.InOrderIdentification = 'GoodsOwnerOrderNumber'
-        InOrderInfo.InOrderOperation = 'CreateOrUpdate'
-        InOrderInfo.ReferenceNumber = data['reference']
-        InOrderInfo.GoodsOwnerOrderNumber = data['order_number']
-        InOrderInfo.OrderDate = data['order_date']
-        InOrderInfo.InDate = data['in_date']
-        return InOrderInfo
+        return self._zeep_object('InOrderInfoClass', self._orderinfo_values(data))
 
     def _prepare_inorder_customerinfo(self, data):
         InOrderCustomer = self.factory.InOrderCustomer()
@@ -180,28 +528,38 @@ class OngoingRequest():
         InOrderCustomer.CountryCode = data['customer_country']
         return InOrderCustomer
 
-    def _prepare_inorder_supplierinfo(self, data):
-        InOrderSupplier = self.factory.InOrderSupplier()
-        InOrderSupplier.InOrderSupplierIdentificationType = 'SupplierNumber'
-        InOrderSupplier.InOrderSupplierOperation = 'Find'
-        InOrderSupplier.SupplierNumber = data['supplier_number']
-        #InOrderSupplier.SupplierName = ''
+    def _inorder_supplierinfo_values(self, data):
+        return {
+            'InOrderSupplierIdentificationType': 'SupplierNumber',
+            'InOrderSupplierOperation': 'Find',
+            'SupplierNumber': data['supplier_number'],
+            #'SupplierName': '',
+        }
 
-        return InOrderSupplier
+    def _prepare_inorder_supplierinfo(self, data):
+        return self._zeep_object('InOrderSupplier', self._inorder_supplierinfo_values(data))
+
+    def _inorder_line_values(self, line):
+        return {
+            'OrderLineIdentification': 'ArticleNumber',
+            'ArticleIdentification': 'ArticleNumber',
+            'NumberOfItems': line['quantity'],
+            'ArticleNumber': line['product_code'],
+        }
 
     def _prepare_inorder_orderlineinfo(self, data):
         InOrderLines = self.factory.ArrayOfInOrderLine()
-        lines = []
-        for line in data['lines']:
-            InOrderLine = self.factory.InOrderLine()
-            InOrderLine.OrderLineIdentification = 'ArticleNumber'
-            InOrderLine.ArticleIdentification = 'ArticleNumber'
-            InOrderLine.NumberOfItems = line['quantity']
-            InOrderLine.ArticleNumber = line['product_code']
-            lines.append(InOrderLine)
-        InOrderLines.InOrderLine = lines
+        InOrderLines.InOrderLine = [self._zeep_object('InOrderLine', self._inorder_line_values(line))
+                                    for line in data['lines']]
         return InOrderLines
 
+    def _inorder_values(self, data):
+        return {
+            'InOrderLines': {'InOrderLine': [self._inorder_line_values(line) for line in data['lines']]},
+            'InOrderSupplier': self._inorder_supplierinfo_values(data),
+            'InOrderInfo': self._orderinfo_values(data),
+        }
+
     def _prepare_inorder_defination(self, data):
         InOrderInfo = self._prepare_orderinfo(data)
         #InOrderCustomer = self._prepare_inorder_customerinfo(data)
@@ -218,6 +576,7 @@ class OngoingRequest():
     # GET InOrder Transaction
     # -----------------------
 
+    @measured
     def get_inbound_order(self, data):
         formatted_response = {
             'error_message': False,
@@ -230,7 +589,8 @@ class OngoingRequest():
             'transactions': list()
         }
         try:
-            self.response = self.client.service.GetInboundTransactionsByQuery(
+            self.response = self._call(
+                'GetInboundTransactionsByQuery',
                 GoodsOwnerCode=self.good_owner_code,
                 UserName=self.username,
                 Password=self.password,
@@ -272,40 +632,31 @@ class OngoingRequest():
     # For creating Sale Order in ongoing
     # ----------------------------------
 
-    def _prepare_order_info(self, data):
+    def _order_info_values(self, data):
+        """ OrderInfoClass values, without its complex children """
         sale_id = data['sale_id']
         picking_id = data['picking_id'].name
-        OrderInfoClass = self.factory.OrderInfoClass()
-        OrderInfoClass.OrderIdentification = 'GoodsOwnerOrderNumber'
-        OrderInfoClass.OrderOperation = 'CreateOrUpdate'
-        OrderInfoClass.GoodsOwnerOrderNumber = f'{sale_id.id}-{picking_id.split("/")[2]}'
-        OrderInfoClass.DeliveryInstruction = sale_id.client_order_ref
-        OrderInfoClass.DeliveryDate = data['in_date']
-        OrderInfoClass.ConsigneeOrderNumber = sale_id.client_order_ref
-
-        OrderInfoClass.WayOfDeliveryType = self._prepare_way_of_delivery_type(data)
-        OrderInfoClass.TermsOfDeliveryType = self._prepare_terms_of_delivery_type()
-        OrderInfoClass.OrderRemark = data['remark']
-        return OrderInfoClass
-
-    def _prepare_way_of_delivery_type(self, data):
+        return {
+            'OrderIdentification': 'GoodsOwnerOrderNumber',
+            'OrderOperation': 'CreateOrUpdate',
+            'GoodsOwnerOrderNumber': f'{sale_id.id}-{picking_id.split("/")[2]}',
+            'DeliveryInstruction': sale_id.client_order_ref,
+            'DeliveryDate': data['in_date'],
+            'ConsigneeOrderNumber': sale_id.client_order_ref,
+            'OrderRemark': data['remark'],
+        }
+
+    def _way_of_delivery_values(self, data):
         # used to be move_type, but now is (transport_service_code, name)
         # Maybe use data['carrier'] to use picking carrier
         way = (data['sale_id'].carrier_id.transport_service_code,
                data['sale_id'].carrier_id.name)
-        WayOfDeliveryType = self.factory.WayOfDeliveryType()
-        WayOfDeliveryType.WayOfDeliveryTypeOperation = "CreateOrUpdate"
-        WayOfDeliveryType.WayOfDeliveryTypeIdentification = "Code"
-        WayOfDeliveryType.Code = way[0]
-        WayOfDeliveryType.Name = way[1]
-        return WayOfDeliveryType
-
-    def _prepare_terms_of_delivery_type(self):
-        TypeClass = self.factory.TypeClass()
-        TypeClass.TypeOperation = "Find"
-        TypeClass.TypeIdentification = "Name"
-        TypeClass.Name = "Standard"
-        return TypeClass
+        return {
+            'WayOfDeliveryTypeOperation': "CreateOrUpdate",
+            'WayOfDeliveryTypeIdentification': "Code",
+            'Code': way[0],
+            'Name': way[1],
+        }
 
     def _create_shipping_address(self, partner, sale_id):
         has_parent = False
@@ -377,10 +728,9 @@ class OngoingRequest():
         }
         return address
 
-    def _prepare_customer(self, data):
+    def _customer_values(self, data):
         partner = data['sale_id'].partner_shipping_id
         shipping_address = self._create_shipping_address(partner, data['sale_id'])
-        Customer = self.factory.Customer()
         customer_number = str(partner.id)
         name = shipping_address["name"]
         street = shipping_address["address"]
@@ -394,32 +744,49 @@ class OngoingRequest():
         mobile = partner.mobile or ''
         country_code = shipping_address["country_code"]
 
-        Customer.CustomerOperation = "CreateOrUpdate"
-        Customer.CustomerIdentification = "ExternalCustomerCode"
-        Customer.ExternalCustomerCode = customer_number
-        Customer.CustomerNumber = partner.ref or ''
-        Customer.Name = name
-        Customer.Address = street
-        Customer.Address2 = address2
-        Customer.Address3 = address3
-        Customer.PostCode = zipcode
-        Customer.City = city
-        Customer.Telephone = phone
-        Customer.Remark = remark
-        Customer.Email = email
-        Customer.MobilePhone = str(mobile)
-        Customer.CountryCode = country_code if country_code else "NO"
-        Customer.NotifyBySMS = "true" if mobile else "false"
-        Customer.NotifyByEmail = "true" if email else "false"
-        Customer.NotifyByTelephone = "true" if email else "false"
-        Customer.IsVisible = "false"
-        return Customer
-
+        return {
+            'CustomerOperation': "CreateOrUpdate",
+            'CustomerIdentification': "ExternalCustomerCode",
+            'ExternalCustomerCode': customer_number,
+            'CustomerNumber': partner.ref or '',
+            'Name': name,
+            'Address': street,
+            'Address2': address2,
+            'Address3': address3,
+            'PostCode': zipcode,
+            'City': city,
+            # Not in the schema (TelePhone), zeep has always dropped it
+            'Telephone': phone,
+            'Remark': remark,
+            'Email': email,
+            'MobilePhone': str(mobile),
+            'CountryCode': country_code if country_code else "NO",
+            'NotifyBySMS': "true" if mobile else "false",
+            'NotifyByEmail': "true" if email else "false",
+            'NotifyByTelephone': "true" if email else "false",
+            'IsVisible': "false",
+        }
 
     def _prepare_supplier(self, data):
+        """ Suppliers repeat across the articles of a batch: build each
+            distinct payload only once per request """
+        key = tuple(sorted(data.items()))
+        Supplier = self._supplier_cache.get(key)
+        if Supplier is None:
+            Supplier = self._supplier_cache[key] = self._build_supplier(data)
+        return Supplier
+
+    def _supplier_values(self, data):
+        """ Supplier values, with its AddressClass as a nested dict """
+        key = ('values',) + tuple(sorted(data.items()))
+        values = self._supplier_cache.get(key)
+        if values is None:
+            values = self._supplier_cache[key] = self._build_supplier_values(data)
+        return values
+
+    def _build_supplier_values(self, data):
         #partner = data['sale_id'].partner_shipping_id
         #shipping_address = self._create_shipping_address(partner, data['sale_id'])
-        Supplier = self.factory.Supplier()
         supplier_number = data['partner_id']
 
         #remark = data['sale_id'].client_order_ref
@@ -427,41 +794,50 @@ class OngoingRequest():
         mobile = data['mobile']
         country_code = data["country_code"]
 
-        Supplier.SupplierOperation = "CreateOrUpdate"
-        Supplier.SupplierIdentificationType = "SupplierNumber"
-        Supplier.SupplierNumber = supplier_number
-        Supplier.SupplierName = data['name']
-        Address = self.factory.AddressClass()
-        Address.Address = data['street']
-        Address.Address2 = data['street2']
-        #Supplier.Address3 = address3
-        Address.PostCode = data['zip']
-        Address.City = data['city']
-        Address.Telephone = data['phone']
-        Address.Remark = data['remark']
-        Address.Email = email
-        Address.MobilePhone = data['mobile']
-        Address.CountryCode = country_code if country_code else "NO"
-        Address.NotifyBySMS = "true" if mobile else "false"
-        Address.NotifyByEmail = "true" if email else "false"
-        Address.NotifyByTelephone = "true" if email else "false"
-        Address.IsVisible = "false"
+        return {
+            'SupplierOperation': "CreateOrUpdate",
+            'SupplierIdentificationType': "SupplierNumber",
+            'SupplierNumber': supplier_number,
+            'SupplierName': data['name'],
+            'Address': {
+                'Address': data['street'],
+                'Address2': data['street2'],
+                #'Address3': address3,
+                'PostCode': data['zip'],
+                'City': data['city'],
+                # Not in the schema (TelePhone), zeep has always dropped it
+                'Telephone': data['phone'],
+                'Remark': data['remark'],
+                'Email': email,
+                'MobilePhone': data['mobile'],
+                'CountryCode': country_code if country_code else "NO",
+                'NotifyBySMS': "true" if mobile else "false",
+                'NotifyByEmail': "true" if email else "false",
+                'NotifyByTelephone': "true" if email else "false",
+                'IsVisible': "false",
+            },
+        }
+
+    def _build_supplier(self, data):
+        values = dict(self._supplier_values(data))
+        Address = self._zeep_object('AddressClass', values.pop('Address'))
+        Supplier = self._zeep_object('Supplier', values)
         Supplier.Address = Address
         return Supplier
 
     def _prepare_suppliers(self, data):
         return [self.factory.AlternativeSupplier(self._prepare_supplier(supp)) for supp in data]
 
-    def _prepare_transporter_contract(self, data):
+    def _transporter_contract_values(self, data):
         _logger.info("Preparing the transporter contract")
         _logger.info("Transporter Service Code is %s", data['sale_id'].carrier_id.fh_transport_service_code)
 
-        TransporterContractClass = self.factory.TransporterContractClass()
-        TransporterContractClass.TransporterContractIdentification = "ServiceCode"
-        TransporterContractClass.TransporterContractOperation = "Find"
-        TransporterContractClass.TransportPayment = "Prepaid"
-        TransporterContractClass.TransporterServiceCode = data['sale_id'].carrier_id.transport_service_code
-        return TransporterContractClass
+        return {
+            'TransporterContractIdentification': "ServiceCode",
+            'TransporterContractOperation': "Find",
+            'TransportPayment': "Prepaid",
+            'TransporterServiceCode': data['sale_id'].carrier_id.transport_service_code,
+        }
 
     def _get_line_qty(self, line):
         if hasattr(line, 'quantity_product_uom'):
@@ -469,55 +845,43 @@ class OngoingRequest():
         else:
             return getattr(line, 'product_uom_qty')
 
-    def _prepare_customer_order_lines(self, data):
-        ArrayOfCustomerOrderLine = self.factory.ArrayOfCustomerOrderLine()
+    def _get_customer_order_line_datas(self, data):
+        """ Order items grouped by product, numbering the lines not sent yet """
         order_items = data['order_items']
-        CustomerOrderLine = []
+        order_items._assign_ongoing_line_numbers()
 
         lines = {}
         for line in order_items:
-            if not line.ongoing_line_number:
-                ongoing_line_number = random.randrange(1000)
-                line.update({'ongoing_line_number': ongoing_line_number})
-                picking = (line.picking_id and line.picking_id.name) or line.picking_id
-                _logger.debug('%s Writing line number %s for line id %s - picking %s', line, ongoing_line_number, line.id, picking)
-            else:
-                ongoing_line_number = line.ongoing_line_number
             key = line.product_id.id
             if key not in lines:
                 lines[key] = {
                     'quantity': self._get_line_qty(line),
                     'default_code': line.product_id.default_code,
-                    'line_number': ongoing_line_number,
+                    'line_number': line.ongoing_line_number,
                 }
             else:
                 lines[key]['quantity'] += self._get_line_qty(line)
 
         _logger.debug('prepare_customer_order_lines %s', ','.join(['%s' % x['line_number'] for x in lines.values()]))
+        return list(lines.values())
+
+    def _customer_orderline_values(self, order_line):
+        """ CustomerOrderLine values, without its VatCode """
+        return {
+            'OrderLineIdentification': "ArticleNumber",
+            'ArticleIdentification': "ArticleNumber",
+            'ArticleNumber': order_line['default_code'],
+            'NumberOfItems': str(order_line['quantity']),
+            'ExternalOrderLineCode': str(order_line['line_number']),
+        }
+
+    @measured
+    def send_prepared_order(self, payload):
+        """ Send a ProcessOrder payload of prepare_order_payload, prepared from
+            recordsets, through run_batch """
+        return self._process_order(self._send_process, payload)
 
-        for order_item in lines.values():
-            CustomerOrderLine.append(self._prepare_customer_orderline(order_item))
-        ArrayOfCustomerOrderLine.CustomerOrderLine = CustomerOrderLine
-        return ArrayOfCustomerOrderLine
-
-    def _prepare_customer_orderline(self, order_line):
-        CustomerOrderLine = self.factory.CustomerOrderLine()
-        CustomerOrderLine.VatCode = self._prepare_vat_code()
-        CustomerOrderLine.OrderLineIdentification = "ArticleNumber"
-        CustomerOrderLine.ArticleIdentification = "ArticleNumber"
-        CustomerOrderLine.ArticleNumber = order_line['default_code']
-        CustomerOrderLine.NumberOfItems = str(order_line['quantity'])
-        CustomerOrderLine.ExternalOrderLineCode = str(order_line['line_number'])
-        return CustomerOrderLine
-
-    def _prepare_vat_code(self):
-        VatCode = self.factory.VatCodeClass()
-        VatCode.VatCodeOperation = "Find"
-        VatCode.VatCodeIdentification = "VatPercent"
-        VatCode.VatPercent = "25"
-        return VatCode
-
-    def _prepare_process_order(self, data):
+    def _process_order(self, send, data):
         formatted_response = {
             'error_message': False,
             'goods_owner_order_number': False,
@@ -528,12 +892,7 @@ class OngoingRequest():
             'message': False,
         }
         try:
-            self.response = self.client.service.ProcessOrder(
-                GoodsOwnerCode=self.good_owner_code,
-                UserName=self.username,
-                Password=self.password,
-                co=self._prepare_customer_order(data),
-            )
+            self.response = send('ProcessOrder', data)
             _logger.debug(self.response)
             if 'ErrorMessage' in self.response:
                 formatted_response['error_message'] = self.response.ErrorMessage
@@ -557,99 +916,261 @@ class OngoingRequest():
             raise error
         return formatted_response
 
-    def _prepare_customer_order(self, data):
-        _logger.info(data or '')
+    def _zeep_customer_order(self, values):
+        """ CustomerOrder zeep object of _customer_order_values """
+        info = dict(values['OrderInfo'])
+        way_of_delivery = info.pop('WayOfDeliveryType')
+        terms_of_delivery = info.pop('TermsOfDeliveryType')
+        OrderInfoClass = self._zeep_object('OrderInfoClass', info)
+        OrderInfoClass.WayOfDeliveryType = self._zeep_object('WayOfDeliveryType', way_of_delivery)
+        OrderInfoClass.TermsOfDeliveryType = self._zeep_object('TypeClass', terms_of_delivery)
+
+        order_lines = []
+        for line in values['CustomerOrderLines']['CustomerOrderLine']:
+            line = dict(line)
+            vat_code = line.pop('VatCode')
+            CustomerOrderLine = self._zeep_object('CustomerOrderLine', line)
+            CustomerOrderLine.VatCode = self._zeep_object('VatCodeClass', vat_code)
+            order_lines.append(CustomerOrderLine)
+        ArrayOfCustomerOrderLine = self.factory.ArrayOfCustomerOrderLine()
+        ArrayOfCustomerOrderLine.CustomerOrderLine = order_lines
+
         CustomerOrder = self.factory.CustomerOrder()
-        CustomerOrder.OrderInfo = self._prepare_order_info(data)
-        CustomerOrder.Customer = self._prepare_customer(data)
-        CustomerOrder.TransporterContract = self._prepare_transporter_contract(data)
-        CustomerOrder.CustomerOrderLines = self._prepare_customer_order_lines(data)
-        _logger.debug('prepare_customer_order %s', CustomerOrder)
+        CustomerOrder.OrderInfo = OrderInfoClass
+        CustomerOrder.Customer = self._zeep_object('Customer', values['Customer'])
+        CustomerOrder.TransporterContract = self._zeep_object('TransporterContractClass',
+                                                              values['TransporterContract'])
+        CustomerOrder.CustomerOrderLines = ArrayOfCustomerOrderLine
         return CustomerOrder
 
-    def _prepare_get_orders_by_query(self, data=None, last_sync=None):
-        formatted_response = {
-            'error_message': False,
-            'goods_owner_order_number': False,
-            'order_id': False,
-            'in_order_id': False,
-            'article_def_id': False,
-            'response': False,
-            'success': False,
-            'message': False,
+    def prepare_order_payload(self, data):
+        """ ProcessOrder payload of data, as prepare_process_payload, and its
+            order_snapshot, both from a single build of the order values """
+        values = self._customer_order_values(data)
+        snapshot = self.order_snapshot(values)
+        return (values if self.compiled_envelopes else self._zeep_customer_order(values)), snapshot
+
+    def _customer_order_values(self, data):
+        _logger.info(data or '')
+        order_info = self._order_info_values(data)
+        order_info['WayOfDeliveryType'] = self._way_of_delivery_values(data)
+        order_info['TermsOfDeliveryType'] = TERMS_OF_DELIVERY_VALUES
+        return {
+            'OrderInfo': order_info,
+            'Customer': self._customer_values(data),
+            'TransporterContract': self._transporter_contract_values(data),
+            'CustomerOrderLines': {
+                'CustomerOrderLine': [dict(self._customer_orderline_values(order_item), VatCode=VAT_CODE_VALUES)
+                                      for order_item in self._get_customer_order_line_datas(data)],
+            },
         }
-        _logger.info('_prepare_get_orders_by_query Last Sync %s', last_sync)
-        try:
-            self.response = self.client.service.GetOrdersByQuery(
-                GoodsOwnerCode=self.good_owner_code,
-                UserName=self.username,
-                Password=self.password,
-                query=self._prepare_orders(data, last_sync),
-            )
-            _logger.debug(self.response)
-            formatted_response['response'] = self.response
-            if not self.response:
-                return formatted_response
 
-            if 'ErrorMessage' in self.response:
-                formatted_response['error_message'] = self.response.ErrorMessage
-            if 'GoodsOwnerOrderNumber' in self.response:
-                formatted_response['goods_owner_order_number'] = self.response.GoodsOwnerOrderNumber
-            if 'OrderId' in self.response:
-                formatted_response['order_id'] = self.response.OrderId
-            if 'InOrderId' in self.response:
-                formatted_response['in_order_id'] = self.response.InOrderId
-            if 'ArticleDefId' in self.response:
-                formatted_response['article_def_id'] = self.response.ArticleDefId
-            if 'Success' in self.response:
-                formatted_response['success'] = self.response.Success
-            if 'Message' in self.response:
-                formatted_response['message'] = self.response.Message
-        except Fault as fault:
-            formatted_response['errors_message'] = fault
-        except IOError:
-            formatted_response['errors_message'] = "Ongoing Server Not Found"
+    # --------------------------
+    # Order updates
+    # --------------------------
+    # The snapshot of an order is the part of its CustomerOrder values that
+    # UpdateOrder and UpdateOrderLines can change. It is stored when the
+    # order is sent, then diffed with the current one so that only what
+    # changed is pushed.
+
+    def order_snapshot(self, values):
+        """ Snapshot of CustomerOrder values (see _customer_order_values),
+            JSON serializable and as read back from JSON """
+        info = values['OrderInfo']
+        customer = dict(values['Customer'])
+        # Not in the schema, see _customer_values
+        customer.pop('Telephone', None)
+        snapshot = {
+            'DeliveryDate': info['DeliveryDate'] or '',
+            'DeliveryInstruction': info['DeliveryInstruction'] or '',
+            'OrderRemark': info['OrderRemark'] or '',
+            'WayOfDeliveryType': [info['WayOfDeliveryType']['Code'], info['WayOfDeliveryType']['Name']],
+            'TransporterContract': values['TransporterContract'],
+            'Customer': customer,
+            'Lines': {line['ExternalOrderLineCode']: [line['ArticleNumber'], float(line['NumberOfItems'])]
+                      for line in values['CustomerOrderLines']['CustomerOrderLine']},
+        }
+        return json.loads(json.dumps(snapshot, default=str))
+
+    def order_changes(self, previous, current):
+        """ Differences between two order snapshots
+            @return: (UpdateOrder values of the changed header fields, or None,
+                      UpdateOrderLine values of the changed quantities,
+                      whether lines were added, which only ProcessOrder can do)
+        """
+        def changed(key):
+            return previous.get(key) != current[key]
+
+        update = {}
+        if changed('DeliveryDate') and current['DeliveryDate']:
+            update['UpdateOrderDeliveryDate'] = {'DeliveryDate': datetime.fromisoformat(current['DeliveryDate'])}
+        if changed('DeliveryInstruction'):
+            update['UpdateOrderDeliveryInstruction'] = {'OrderDeliveryInstruction': current['DeliveryInstruction']}
+        if changed('OrderRemark'):
+            update['UpdateOrderRemark'] = {'OrderRemark': current['OrderRemark']}
+        if changed('WayOfDeliveryType'):
+            code, name = current['WayOfDeliveryType']
+            update['UpdateOrderWayOfDeliveryType'] = {
+                'Operation': 'FindOrCreate',
+                'Identification': 'WayOfDeliveryTypeCode',
+                'WayOfDeliveryTypeCode': code,
+                'WayOfDeliveryTypeName': name,
+            }
+        if changed('TransporterContract'):
+            update['UpdateOrderTransporterContract'] = {'TransporterContract': current['TransporterContract']}
+        if changed('Customer'):
+            update['UpdateOrderCustomerAndNotification'] = {'Customer': current['Customer']}
+
+        sent_lines = previous.get('Lines', {})
+        lines, added = [], False
+        for code, (article, quantity) in current['Lines'].items():
+            sent = sent_lines.get(code)
+            if not sent or sent[0] != article:
+                added = True
+            elif sent[1] != quantity:
+                lines.append(self._update_order_line_values(code, quantity))
+        # Lines gone from the picking are emptied
+        lines += [self._update_order_line_values(code, 0) for code in sent_lines.keys() - current['Lines'].keys()]
+        return update or None, lines, added
+
+    def _update_order_line_values(self, code, quantity):
+        return {
+            'UpdateOrderLineIdentification': {
+                'OrderLineIdentificationType': 'ExternalOrderLineCode',
+                'ExternalOrderLineCode': code,
+                'OrderLineId': None,
+            },
+            'UpdateNumberOfItems': {'NumberOfItems': quantity},
+        }
 
-        return formatted_response
+    def _update_result(self, response):
+        self.response = response
+        _logger.debug(response)
+        return {
+            'success': bool(response and response.Success),
+            'message': (response and response.Message) or '',
+            'order_id': response and response.OrderId,
+        }
 
-    def parse_tracking_numbers(self, response):
-        Orders = response.get('Order')
-        picking_map = {"status": {}, "tracking": {}, "tracking_url": {}, "serial": {}, "goods_info": {}}
-
-        for Order in Orders:
-            OrderInfo = Order['OrderInfo']
-            OrderPalletItems = Order['OrderPalletItems']
-
-            # Obtain order status
-            order_id = OrderInfo['OrderId']
-            order_status = OrderInfo['OrderStatusText']
-            picking_map['status'][order_id] = order_status
-
-            # Obtain tracking number
-            if order_status == "Sendt" and OrderPalletItems:
-                for pallet_item in OrderPalletItems['OrderPalletItemInfo']:
-                    if order_id not in picking_map['goods_info']:
-                        picking_map['goods_info'][order_id] = []
-                    picking_map['goods_info'][order_id].append(pallet_item['Id'])
-
-                    if not pallet_item['IsTaPalletItem']:
-                        continue
-                    tracking_number = pallet_item['LabelId'] or ''
-                    tracking_url = pallet_item.get('Tracking', None) and pallet_item['Tracking']['TrackingUrl']
-                    picking_map['tracking'][order_id] = tracking_number
-                    if order_id not in picking_map['tracking_url']:
-                        picking_map['tracking_url'][order_id] = []
-                    picking_map['tracking_url'][order_id].append(tracking_url)
-
-            # Obtain serials
-            if order_status == "Sendt" and Order['PickedArticleItems']:
-                serial = [({'default_code': res['Article']['ArticleNumber'], 'serial':res['Serial'], 'done_qty': int(res['NumberOfItems'])}) for res in Order['PickedArticleItems']['PickedArticleItem']]
-                picking_map['serial'][order_id] = serial
-
-        return picking_map
-
-    def _prepare_orderids(self, pickings):
-        ongoing_order_ids = [picking.ongoing_order_id for picking in pickings]
+    @measured
+    def update_order(self, order_id, values):
+        """ Send UpdateOrder values (see order_changes) for the Ongoing order order_id """
+        values = dict(values, OrderUpdateIdentification={
+            'OrderIdentificationType': 'SystemId',
+            'OrderId': int(order_id),
+        })
+        return self._update_result(self._call_values('UpdateOrder', updateOrder=values))
+
+    @measured
+    def update_order_lines(self, order_id, lines):
+        """ Send UpdateOrderLine values (see order_changes) for the Ongoing order order_id """
+        return self._update_result(self._call_values('UpdateOrderLines', UpdateOrderLines={
+            'UpdateOrderIdentification': {
+                'OrderIdentificationType': 'SystemId',
+                'OrderId': int(order_id),
+            },
+            'OrderLines': {'UpdateOrderLine': lines},
+        }))
+
+    @measured
+    def stream_orders(self, pickings=None, last_sync=None, order_ids=None, raise_errors=False,
+                      status_changed_from=None):
+        """ GetOrdersByQuery for the orders of pickings (or order_ids),
+            optionally filtered by last_sync and status_changed_from (see
+            _prepare_orders). The response is parsed while it is read and the
+            orders are yielded one by one as compact dicts (see
+            ongoing_order_stream.compact_order), instead of building the
+            whole zeep object tree in memory.
+
+            @param order_ids: Ongoing order ids to get, instead of the ones of pickings
+            @param raise_errors: raise Fault and IOError instead of logging them
+            @param status_changed_from: only the orders whose status changed since then
+            Errors are logged and give no orders, like an empty response.
+        """
+        _logger.info('stream_orders Last Sync %s', last_sync)
+        service = self.client.service
+        binding = service._binding
+        build_started, self._build_started = self._build_started or time.perf_counter(), None
+        phases = {}
+        outcome, request_bytes = 'error', 0
+        try:
+            query = self._prepare_orders(pickings, last_sync, order_ids, status_changed_from)
+            serialize_started = time.perf_counter()
+            phases['build'] = serialize_started - build_started
+            envelope, http_headers = binding._create(
+                'GetOrdersByQuery', (), {
+                    'GoodsOwnerCode': self.good_owner_code,
+                    'UserName': self.username,
+                    'Password': self.password,
+                    'query': query,
+                }, client=self.client, options=service._binding_options)
+            message = etree_to_string(envelope)
+            request_bytes = len(message)
+            network_started = time.perf_counter()
+            phases['serialize'] = network_started - serialize_started
+            response = self.client.transport.post_stream(
+                service._binding_options['address'], message, http_headers)
+            phases['network'] = time.perf_counter() - network_started
+            if response.status_code != 200:
+                outcome = 'fault'
+                # Reads the whole (small) body and raises the SOAP fault
+                binding.process_reply(self.client, binding.get('GetOrdersByQuery'), response)
+                return iter(())
+        except Fault as fault:
+            if raise_errors:
+                raise
+            _logger.warning('Ongoing: GetOrdersByQuery failed: %s', fault)
+            return iter(())
+        except IOError as error:
+            self._archive_failure('GetOrdersByQuery', error)
+            if raise_errors:
+                raise
+            _logger.warning('Ongoing: GetOrdersByQuery failed: Ongoing Server Not Found')
+            return iter(())
+        finally:
+            if 'network' not in phases or outcome == 'fault':
+                phases['total'] = time.perf_counter() - build_started
+                record_call(self.metrics_key, 'GetOrdersByQuery', phases, outcome, request_bytes)
+        archive_plugin = self._archive_plugin()
+        exchange = archive_plugin and archive_plugin.start_stream('GetOrdersByQuery')
+        return self._iter_response_orders(response, phases, build_started, request_bytes, exchange)
+
+    def fetch_orders(self, order_ids):
+        """ Orders of the Ongoing order_ids, as an index order id -> OrderState.
+
+            Meant for run_batch and iter_batch: the response is read in the
+            calling thread, and errors are raised so the caller can retry.
+        """
+        return self.parse_order_states(self.stream_orders(order_ids=order_ids, raise_errors=True))
+
+    def _iter_response_orders(self, response, phases, build_started, request_bytes, exchange=None):
+        """ Orders of a streamed response. The parse phase, which includes
+            reading the body, is recorded once the response is consumed, and
+            the exchange archived once it is complete or failed. """
+        parse_started = time.perf_counter()
+        outcome = 'fault'
+        try:
+            yield from iter_orders(exchange.wrap(response.raw) if exchange else response.raw)
+            outcome = 'success'
+            if exchange:
+                exchange.done()
+        except Exception as error:
+            if exchange:
+                exchange.done(error)
+            raise
+        finally:
+            now = time.perf_counter()
+            phases['parse'] = now - parse_started
+            phases['total'] = now - build_started
+            record_call(self.metrics_key, 'GetOrdersByQuery', phases, outcome, request_bytes, response.raw.tell())
+            response.close()
+
+    def parse_order_states(self, orders):
+        """ Index order id -> OrderState of orders (compact dicts, as yielded
+            by stream_orders), built in a single pass """
+        return index_order_states(orders)
+
+    def _prepare_orderids(self, ongoing_order_ids):
         ArrayOfInt = self.factory.ArrayOfInt()
         int = []
         for ongoing_order_id in ongoing_order_ids:
@@ -658,17 +1179,23 @@ class OngoingRequest():
         ArrayOfInt.int = int
         return ArrayOfInt
 
-    def _prepare_orders(self, pickings, last_sync=None):
+    def _prepare_orders(self, pickings, last_sync=None, order_ids=None, status_changed_from=None):
         OrderFilters = self.factory.OrderFilters()
 
         if pickings:
-            OrderFilters.OrderIdsToGet = self._prepare_orderids(pickings)
+            order_ids = [picking.ongoing_order_id for picking in pickings]
+        if order_ids:
+            OrderFilters.OrderIdsToGet = self._prepare_orderids(order_ids)
 
         if last_sync:
             OrderFilters.LastReturnedFrom = last_sync
 
+        if status_changed_from:
+            OrderFilters.OrderStatusChangedTimeFrom = status_changed_from
+
         return OrderFilters
 
+    @measured
     def _get_serial_numbers_ongoing(self, order_id):
         formatted_response = {
             'success': False,
@@ -676,7 +1203,8 @@ class OngoingRequest():
             'serial_no_list': False,
         }
         try:
-            self.response = self.client.service.GetOrder(
+            self.response = self._call(
+                'GetOrder',
                 UserName=self.username,
                 Password=self.password,
                 OrderId=order_id,
@@ -691,27 +1219,3 @@ class OngoingRequest():
         except IOError:
             formatted_response['message'] = "Ongoing Server Not Found"
         return formatted_response
-
-    def get_return_orders_ongoing(self):
-        formatted_response = {
-            'success': False,
-            'message': False,
-            'serial_no_list': False,
-        }
-        try:
-            self.response = self.client.service.GetOrdersByQuery(
-                UserName=self.username,
-                Password=self.password,
-                GoodsOwnerCode='Lillelam, Odoo',
-                GetOrdersQuery=self._prepare_get_orders_by_query(),
-            )
-            _logger.debug(self.response)
-            assert not self.response['ReturnOrders']
-
-        except IOError:
-            formatted_response['message'] = "Ongoing Server Not Found"
-
-        if 'Success' in self.response:
-            formatted_response['success'] = self.response.Success
-
-        return formatted_response
\ No newline at end of file
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from zeep import Client, Settings
+from zeep.transports import Transport
+from zeep.wsdl import Document
+
+from odoo.modules.module import get_resource_path
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+BUNDLED_WSDL = get_resource_path('flyt_ongoing_int', 'api', 'ongoing.wsdl')
+SOAP_BINDING = '{http://ongoingsystems.se/WSI}ServiceSoap'
+# How long a downloaded WSDL is trusted before we look for a new version
+WSDL_CACHE_TTL = 24 * 60 * 60
+# How long a stale or bundled fallback is used before the download is retried
+WSDL_RETRY_TTL = 5 * 60
+WSDL_FETCH_TIMEOUT = 10
+
+_lock = threading.RLock()
+# content hash -> parsed zeep Document, shared by every client of this process
+_documents = {}
+# url -> (content hash, timestamp after which it is checked again)
+_urls = {}
+
+
+class CachedClient(Client):
+    """ zeep Client built on top of an already parsed WSDL document.
+
+        zeep parses the WSDL in Client.__init__, which is what makes building
+        a client expensive. The parsed Document is read-only once built, so
+        it is shared and only the cheap per-client state is set up here.
+    """
+
+    def __init__(self, document, address=None, transport=None, plugins=None, settings=None):
+        self.settings = settings or Settings()
+        self.transport = transport if transport is not None else self._default_transport()
+        self.wsdl = document
+        self.wsse = None
+        self.plugins = plugins if plugins is not None else []
+        self._default_service = None
+        self._default_service_name = None
+        self._default_port_name = None
+        self._default_soapheaders = None
+        if address:
+            # The document may come from the bundled WSDL, whose soap:address
+            # points to another Ongoing instance than the configured one
+            self._default_service = self.create_service(SOAP_BINDING, address)
+
+
+def _service_address(url):
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        return None
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, '', ''))
+
+
+def _cache_path(url):
+    directory = os.path.join(config['data_dir'], 'ongoing_wsdl')
+    return os.path.join(directory, '%s.wsdl' % hashlib.sha1(url.encode()).hexdigest())
+
+
+def _read_file(path):
+    with open(path, 'rb') as wsdl_file:
+        return wsdl_file.read()
+
+
+def _write_artifact(path, content):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as wsdl_file:
+            wsdl_file.write(content)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        _logger.warning('Ongoing: unable to store WSDL cache %s: %s', path, e)
+
+
+def _fetch_wsdl(url):
+    """ Return the WSDL content for url and how long it can be trusted,
+        trying in order: a fresh on-disk artifact, the network, a stale
+        on-disk artifact and the WSDL bundled with the module.
+    """
+    path = _cache_path(url)
+    if os.path.isfile(path):
+        age = time.time() - os.path.getmtime(path)
+        if age < WSDL_CACHE_TTL:
+            return _read_file(path), WSDL_CACHE_TTL - age
+
+    if _service_address(url):
+        try:
+            response = requests.get(url, timeout=WSDL_FETCH_TIMEOUT)
+            response.raise_for_status()
+            _write_artifact(path, response.content)
+            return response.content, WSDL_CACHE_TTL
+        except requests.RequestException as e:
+            _logger.warning('Ongoing: unable to download WSDL from %s: %s', url, e)
+    elif os.path.isfile(url):
+        return _read_file(url), WSDL_CACHE_TTL
+
+    if os.path.isfile(path):
+        _logger.info('Ongoing: using stale WSDL cache for %s', url)
+        return _read_file(path), WSDL_RETRY_TTL
+    _logger.info('Ongoing: using bundled WSDL for %s', url)
+    return _read_file(BUNDLED_WSDL), WSDL_RETRY_TTL
+
+
+def get_wsdl_document(url):
+    """ Return the parsed WSDL for url, parsing it at most once per content
+        hash and per process.
+    """
+    with _lock:
+        cached = _urls.get(url)
+        if cached and time.time() < cached[1]:
+            return _documents[cached[0]]
+
+        content, ttl = _fetch_wsdl(url)
+        digest = hashlib.sha256(content).hexdigest()
+        document = _documents.get(digest)
+        if document is None:
+            started = time.monotonic()
+            document = Document(io.BytesIO(content), Transport(), settings=Settings())
+            _logger.info('Ongoing: parsed WSDL for %s in %.2fs', url, time.monotonic() - started)
+            _documents[digest] = document
+        _urls[url] = (digest, time.time() + ttl)
+        return document
+
+
+def get_client(url, transport=None, plugins=None):
+    """ Build a zeep client for url on top of the cached WSDL document """
+    return CachedClient(get_wsdl_document(url), _service_address(url), transport=transport, plugins=plugins)
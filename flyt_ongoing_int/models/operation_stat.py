@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import json
+import logging
+
+from odoo import models, api, fields
+from .ongoing_metrics import Histogram, PHASES
+
+_logger = logging.getLogger(__name__)
+
+STATS_RETENTION_DAYS = 30
+
+
+class OngoingOperationStat(models.Model):
+    _name = 'ongoing.operation.stat'
+    _description = 'Ongoing SOAP call statistics'
+    _order = 'period_start desc, id desc'
+
+    period_start = fields.Datetime(required=True, index=True)
+    period_end = fields.Datetime()
+    company_id = fields.Many2one('res.company', ondelete='cascade', index=True)
+    operation = fields.Char(required=True, index=True)
+    calls = fields.Integer()
+    successes = fields.Integer()
+    failures = fields.Integer(help='Calls answered with Success false')
+    faults = fields.Integer(help='Calls answered with a SOAP fault')
+    errors = fields.Integer(help='Calls that got no answer (connection errors, timeouts)')
+    request_bytes = fields.Integer()
+    response_bytes = fields.Integer()
+    build_sum = fields.Float(digits=(16, 4))
+    build_p50 = fields.Float(digits=(16, 4))
+    build_p99 = fields.Float(digits=(16, 4))
+    build_count = fields.Integer()
+    serialize_sum = fields.Float(digits=(16, 4))
+    serialize_p50 = fields.Float(digits=(16, 4))
+    serialize_p99 = fields.Float(digits=(16, 4))
+    serialize_count = fields.Integer()
+    network_sum = fields.Float(digits=(16, 4))
+    network_p50 = fields.Float(digits=(16, 4))
+    network_p99 = fields.Float(digits=(16, 4))
+    network_count = fields.Integer()
+    parse_sum = fields.Float(digits=(16, 4))
+    parse_p50 = fields.Float(digits=(16, 4))
+    parse_p99 = fields.Float(digits=(16, 4))
+    parse_count = fields.Integer(help='Calls that reached the parse phase')
+    total_sum = fields.Float(digits=(16, 4))
+    total_p50 = fields.Float(digits=(16, 4))
+    total_p99 = fields.Float(digits=(16, 4))
+    total_max = fields.Float(digits=(16, 4))
+    histograms = fields.Text(help='Bucket counts per phase, see ongoing_metrics.BUCKETS')
+
+    @api.model
+    def _merged_histograms(self, since):
+        """ Merge the histograms of the periods started after since
+            @return: dict (company id, operation) -> dict phase -> Histogram
+        """
+        self.env.cr.execute("""
+            SELECT company_id, operation, histograms
+              FROM ongoing_operation_stat
+             WHERE period_start >= %s AND histograms IS NOT NULL
+        """, [since])
+        merged = {}
+        for company_id, operation, histograms in self.env.cr.fetchall():
+            phases = merged.setdefault((company_id, operation), {phase: Histogram() for phase in PHASES})
+            for phase, counts in json.loads(histograms).items():
+                phases[phase].merge(Histogram(counts))
+        return merged
+
+    @api.model
+    def _totals(self):
+        """ Counters summed over every stored period, by company and operation,
+            ending with the sum then the observation count of each phase.
+            Periods stored without phase counts count every call. """
+        self.env.cr.execute("""
+            SELECT company_id, operation, SUM(calls), SUM(successes), SUM(failures), SUM(faults), SUM(errors),
+                   SUM(request_bytes), SUM(response_bytes),
+                   SUM(build_sum), SUM(serialize_sum), SUM(network_sum), SUM(parse_sum), SUM(total_sum),
+                   SUM(COALESCE(build_count, calls)), SUM(COALESCE(serialize_count, calls)),
+                   SUM(COALESCE(network_count, calls)), SUM(COALESCE(parse_count, calls)), SUM(calls)
+              FROM ongoing_operation_stat
+          GROUP BY company_id, operation
+        """)
+        return self.env.cr.fetchall()
+
+    @api.model
+    def _cron_purge(self):
+        self.env.cr.execute("""
+            DELETE FROM ongoing_operation_stat
+             WHERE period_start < (NOW() at time zone 'UTC') - %s * interval '1 day'
+        """, [STATS_RETENTION_DAYS])
+        _logger.info('Ongoing: purged %s operation stats', self.env.cr.rowcount)
+        self.invalidate_model()
+        return True
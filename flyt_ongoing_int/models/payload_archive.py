@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import base64
+import io
+import logging
+import random
+import re
+import threading
+import time
+import zlib
+
+from psycopg2 import Binary
+from zeep import Plugin
+from zeep.wsdl.utils import etree_to_string
+
+from odoo import models, api, fields, SUPERUSER_ID
+from .ongoing_log_writer import LogWriter, get_log_writer
+
+_logger = logging.getLogger(__name__)
+
+TNS = '{http://ongoingsystems.se/WSI}'
+SOAP_FAULT = '{http://schemas.xmlsoap.org/soap/envelope/}Fault'
+# Elements identifying the order, in-order or article a payload is about
+REFERENCE_TAGS = tuple(TNS + name for name in ('GoodsOwnerOrderNumber', 'OrderId', 'ArticleNumber'))
+PASSWORD_RE = re.compile(rb'(<(?:[\w-]+:)?Password>)[^<]*(</)')
+
+
+def parse_operation_rates(rates):
+    """ 'ProcessOrder=1, GetOrdersByQuery=0.01' -> (('ProcessOrder', 1.0), ('GetOrdersByQuery', 0.01)) """
+    parsed = []
+    for rule in (rates or '').split(','):
+        operation, sep, rate = rule.partition('=')
+        if not sep:
+            continue
+        try:
+            parsed.append((operation.strip(), float(rate)))
+        except ValueError:
+            _logger.warning('Ongoing: ignoring invalid archive sampling rule %r', rule)
+    return tuple(parsed)
+
+
+class PayloadArchiveWriter(LogWriter):
+    """ Background batched writer of ongoing_payload_archive rows """
+    _query = """
+        INSERT INTO ongoing_payload_archive
+            (create_uid, create_date, write_uid, write_date, company_id, operation, reference,
+             success, latency, size, compressed_size, request, response)
+        VALUES %s
+    """
+    _template = ("(%s, NOW() at time zone 'UTC', %s, NOW() at time zone 'UTC', "
+                 "%s, %s, %s, %s, %s, %s, %s, %s, %s)")
+
+    def _rows(self, batch):
+        rows = []
+        for company_id, operation, reference, success, latency, request, response in batch:
+            size = len(request) + len(response)
+            request, response = zlib.compress(request), zlib.compress(response)
+            # Stored base64 encoded, as the ORM does for Binary columns
+            rows.append((SUPERUSER_ID, SUPERUSER_ID, company_id, operation, reference, success, latency,
+                         size, len(request) + len(response),
+                         Binary(base64.b64encode(request)), Binary(base64.b64encode(response))))
+        return rows
+
+
+class ArchivePlugin(Plugin):
+    """ zeep plugin sampling the exchanges of a company client into the
+        payload archive.
+
+        The request envelope is only kept by reference until its response
+        arrives: the sampling decision needs the outcome, and unsampled
+        exchanges are then dropped without ever being serialized. Failures
+        (SOAP faults, Success false, transport errors) are always archived.
+
+        zeep only calls ingress for the responses it parses itself: the
+        callers report calls answered by a transport error (failed) and
+        streamed responses (start_stream).
+    """
+
+    def __init__(self, writer, company_id, success_rate=0.01, operation_rates=()):
+        self.writer = writer
+        self.company_id = company_id
+        self.success_rate = success_rate
+        self.operation_rates = dict(operation_rates)
+        self._pending = threading.local()
+
+    def _take_request(self):
+        request, started = getattr(self._pending, 'request', None) or (None, None)
+        self._pending.request = None
+        return request, started
+
+    def _sampled(self, operation_name):
+        return random.random() < self.operation_rates.get(operation_name, self.success_rate)
+
+    def _archive(self, operation_name, request, success, latency, response):
+        reference = None
+        for node in request.iter(*REFERENCE_TAGS):
+            if node.text:
+                reference = node.text
+                break
+        self.writer.log(self.company_id, operation_name, reference, success, latency,
+                        PASSWORD_RE.sub(rb'\1***\2', etree_to_string(request)), response)
+
+    def egress(self, envelope, http_headers, operation, binding_options):
+        self._pending.request = (envelope, time.monotonic())
+        return envelope, http_headers
+
+    def ingress(self, envelope, http_headers, operation):
+        request, started = self._take_request()
+        if request is None:
+            return envelope, http_headers
+        latency = time.monotonic() - started
+
+        success = envelope.find('.//' + SOAP_FAULT) is None
+        if success:
+            node = envelope.find('.//%sSuccess' % TNS)
+            success = node is None or node.text != 'false'
+        if success and not self._sampled(operation.name):
+            return envelope, http_headers
+        self._archive(operation.name, request, success, latency, etree_to_string(envelope))
+        return envelope, http_headers
+
+    def failed(self, operation_name, error):
+        """ Archive the pending request of a call that got no response to
+            parse (connection error, timeout...), with the error as response """
+        request, started = self._take_request()
+        if request is not None:
+            self._archive(operation_name, request, False, time.monotonic() - started, str(error).encode())
+
+    def start_stream(self, operation_name):
+        """ StreamedExchange of the pending request, for a response read
+            incrementally instead of going through ingress """
+        request, started = self._take_request()
+        if request is None:
+            return None
+        return StreamedExchange(self, operation_name, request, started, self._sampled(operation_name))
+
+
+class StreamedExchange():
+    """ Archiving of a streamed response: a sampled one is copied while it
+        is read (see wrap), an unsampled one is only archived on failure,
+        with the error in place of the response it was not kept of """
+
+    def __init__(self, plugin, operation_name, request, started, sampled):
+        self.plugin = plugin
+        self.operation_name = operation_name
+        self.request = request
+        self.started = started
+        self.buffer = io.BytesIO() if sampled else None
+
+    def wrap(self, raw):
+        """ File-like object to read the response from instead of raw """
+        return _TeeReader(raw, self.buffer) if self.buffer is not None else raw
+
+    def done(self, error=None):
+        """ Archive the exchange, once its response is read or failed """
+        if error is None and self.buffer is None:
+            return
+        response = self.buffer.getvalue() if self.buffer is not None else b''
+        if error is not None:
+            response += str(error).encode()
+        self.plugin._archive(self.operation_name, self.request, error is None,
+                             time.monotonic() - self.started, response)
+
+
+class _TeeReader():
+    """ Read from raw, copying what is read to buffer """
+
+    def __init__(self, raw, buffer):
+        self.raw = raw
+        self.buffer = buffer
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.buffer.write(data)
+        return data
+
+    def tell(self):
+        return self.raw.tell()
+
+
+class OngoingPayloadArchive(models.Model):
+    _name = 'ongoing.payload.archive'
+    _description = 'Archived Ongoing SOAP exchange'
+    _order = 'id desc'
+
+    company_id = fields.Many2one('res.company', required=True, ondelete='cascade', index=True)
+    operation = fields.Char(required=True, index=True)
+    reference = fields.Char(index=True, help='Order number, order id or article number found in the request')
+    success = fields.Boolean()
+    latency = fields.Float(string='Latency (s)', digits=(16, 3))
+    size = fields.Integer(string='Size (bytes)', help='Uncompressed size of the request and response')
+    compressed_size = fields.Integer(string='Stored size (bytes)')
+    request = fields.Binary(attachment=False)
+    response = fields.Binary(attachment=False)
+    request_text = fields.Text(compute='_compute_payload_text')
+    response_text = fields.Text(compute='_compute_payload_text')
+
+    @api.depends('request', 'response')
+    def _compute_payload_text(self):
+        for record in self.with_context(bin_size=False):
+            record.request_text = record._decompress(record.request)
+            record.response_text = record._decompress(record.response)
+
+    def _decompress(self, value):
+        if not value:
+            return False
+        # Binary fields are read back base64 encoded
+        return zlib.decompress(base64.b64decode(value)).decode()
+
+    @api.model
+    def _cron_purge(self):
+        """ Enforce every company's archive retention: drop the rows older
+            than ongoing_archive_days, then the oldest rows beyond
+            ongoing_archive_max_mb of stored payloads """
+        self.env.cr.execute("""
+            DELETE FROM ongoing_payload_archive a
+             USING res_company c
+             WHERE a.company_id = c.id
+               AND c.ongoing_archive_days > 0
+               AND a.create_date < (NOW() at time zone 'UTC') - c.ongoing_archive_days * interval '1 day'
+        """)
+        expired = self.env.cr.rowcount
+        self.env.cr.execute("""
+            DELETE FROM ongoing_payload_archive
+             WHERE id IN (
+                SELECT a.id
+                  FROM (SELECT id, company_id,
+                               SUM(compressed_size) OVER (PARTITION BY company_id ORDER BY id DESC) AS total
+                          FROM ongoing_payload_archive) a
+                  JOIN res_company c ON c.id = a.company_id
+                 WHERE c.ongoing_archive_max_mb > 0
+                   AND a.total > c.ongoing_archive_max_mb * 1024 * 1024
+             )
+        """)
+        _logger.info('Ongoing: purged %s expired and %s oversize archived payloads', expired, self.env.cr.rowcount)
+        self.invalidate_model()
+        return True
+
+
+def get_archive_plugin(dbname, company_id, success_rate, operation_rates):
+    """ Return an ArchivePlugin writing through the archive writer of dbname """
+    return ArchivePlugin(get_log_writer(dbname, PayloadArchiveWriter), company_id, success_rate, operation_rates)
@@ -4,7 +4,6 @@
 import logging
 from odoo import models, api, fields, registry, SUPERUSER_ID, _
 from odoo.exceptions import UserError
-from .ongoing_wms_request import OngoingRequest
 
 _logger = logging.getLogger(__name__)
 
@@ -14,8 +13,10 @@ class PurchaseOrder(models.Model):
     _inherit = ['purchase.order', 'ongoing.logger.mixin']
 
     def button_approve(self, force=False):
+        # Suppliers are usually shared by the orders approved together
+        supplier_cache = {}
         for order in self:
-            order.action_sync_product()
+            order.action_sync_product(supplier_cache=supplier_cache)
         result = super(PurchaseOrder, self).button_approve(force=force)
         return result
 
@@ -24,14 +25,24 @@ class PurchaseOrder(models.Model):
         for order in self:
             pickings = order.picking_ids.filtered(lambda p: p.state not in ['done', 'cancel'] and p.picking_type_code == 'incoming')
             if pickings:
-                pickings[0].action_sync_in_order()
+                self.env['ongoing.job']._enqueue('in_order', pickings[0])
         return result
 
     def _check_validation_article(self):
         if any(not p.default_code for p in self.order_line.mapped('product_id')):
             raise UserError(_('Internal Reference on product is missing'))
 
-    def _prepare_supplier_data(self, partner_id):
+    def _prepare_supplier_data(self, partner_id, cache=None):
+        """ Supplier payload of a partner, memoized in cache (if given) for
+            as long as the partner is not modified """
+        if cache is None:
+            return self._build_supplier_data(partner_id)
+        key = (partner_id.id, partner_id.write_date)
+        if key not in cache:
+            cache[key] = self._build_supplier_data(partner_id)
+        return cache[key]
+
+    def _build_supplier_data(self, partner_id):
         return {
             'partner_id': partner_id.id,
             'name': partner_id.name,
@@ -45,28 +56,36 @@ class PurchaseOrder(models.Model):
             'country_code': partner_id.country_code or 'NO',
             'remark': partner_id.comment or '',
         }
-    def _prepare_all_supplier_data(self, product):
+
+    def _prepare_all_supplier_data(self, product, cache=None):
         if not product.seller_ids:
             return None
 
         return [
-            self._prepare_supplier_data(s.partner_id)
+            self._prepare_supplier_data(s.partner_id, cache)
         for s in product.seller_ids ]
 
-    def _prepare_article_datas(self):
+    def _prepare_article_datas(self, supplier_cache=None):
         """ Called from purchase """
+        if supplier_cache is None:
+            supplier_cache = {}
         return [
             {
+                'product_id': l.product_id.id,
                 'name': l.product_id.name,
                 'default_code': l.product_id.default_code,
                 'barcode': l.product_id.barcode,
                 'price': l.price_unit,
                 'uom': l.product_uom.name,
-                'supplier': self._prepare_supplier_data(l.partner_id),
-                'alternate_suppliers': self._prepare_all_supplier_data(l.product_id)
+                'supplier': self._prepare_supplier_data(l.partner_id, supplier_cache),
+                'alternate_suppliers': self._prepare_all_supplier_data(l.product_id, supplier_cache)
             } for l in self.order_line]
 
-    def action_sync_product(self):
+    def action_force_sync_product(self):
+        """ Send every article of the order, even the ones Ongoing already has """
+        return self.with_context(ongoing_force_article_sync=True).action_sync_product()
+
+    def action_sync_product(self, supplier_cache=None):
         self.ensure_one()
         # don't do anything is ongoing service is not activate on company
         if not self.company_id.activate_ongoing:
@@ -75,15 +94,19 @@ class PurchaseOrder(models.Model):
         url, username, password, good_owner_code = self._get_ongoing_credential()
         if not username or not password or not good_owner_code:
             raise UserError(_('Credential Missing'))
-        request = OngoingRequest(self.log_xml, url, username, password, good_owner_code)
-        for data in self._prepare_article_datas():
-            response = request.process_article(data)
+        Fingerprint = self.env['ongoing.article.fingerprint']
+        datas = Fingerprint._filter_changed_articles(
+            self.company_id, self._prepare_article_datas(supplier_cache),
+            force=self.env.context.get('ongoing_force_article_sync'))
+        request = self._get_ongoing_request(bulk=self._is_ongoing_bulk(len(datas)))
+        for data, response in zip(datas, request.run_batch('process_article', datas)):
             if not response.get('success'):
                 _logger.error('Error updating inorder line %s', data['name'])
                 message = response.get('message', '')
                 if response.get('error_message'):
                     message = message + '\n' + response['error_message']
                 raise UserError(message)
+        Fingerprint._store_articles(self.company_id, datas)
         self.last_sync_on = fields.Datetime.now()
         return {
             'effect': {
@@ -2,9 +2,15 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
 from odoo import models, api, fields, _
+from .ongoing_wms_request import invalidate_company_clients
 
 
 DEFAULT_API_URL = 'https://api.ongoingsystems.se/colliflow/service.asmx?WSDL'
+# Fields the cached Ongoing clients are built from
+ONGOING_CLIENT_FIELDS = ('ongoing_url', 'ongoing_username', 'ongoing_password', 'ongoing_good_owner_code',
+                         'ongoing_pool_size', 'ongoing_connect_timeout', 'ongoing_read_timeout',
+                         'ongoing_log_traffic', 'ongoing_archive_payloads', 'ongoing_archive_success_rate',
+                         'ongoing_archive_operation_rates')
 
 class ResCompany(models.Model):
     _inherit = 'res.company'
@@ -20,5 +26,59 @@ class ResCompany(models.Model):
     ongoing_password = fields.Char()
     ongoing_url = fields.Char(string='URL to Ongoing WMS api', default=DEFAULT_API_URL)
     ongoing_good_owner_code = fields.Char(string='Good Owner Code')
+    ongoing_pool_size = fields.Integer(string='Ongoing connection pool size', default=10)
+    ongoing_connect_timeout = fields.Float(string='Ongoing connect timeout (s)', default=5.0)
+    ongoing_read_timeout = fields.Float(string='Ongoing read timeout (s)', default=60.0)
+    ongoing_max_concurrency = fields.Integer(string='Ongoing concurrent calls', default=4,
+                                             help='Maximum number of SOAP calls sent in parallel for batch operations')
+    ongoing_compiled_envelopes = fields.Boolean(
+        string='Compiled Ongoing envelopes', default=False,
+        help='Render ProcessOrder, ProcessInOrder and ProcessArticle requests directly from the schema '
+             'instead of building zeep objects. The XML sent is the same.')
+    ongoing_log_traffic = fields.Boolean(
+        string='Log Ongoing traffic', default=False,
+        help='Store every SOAP request and response exchanged with Ongoing in the server logs (ir.logging)')
+    ongoing_archive_payloads = fields.Boolean(
+        string='Archive Ongoing payloads', default=False,
+        help='Keep compressed copies of the SOAP exchanges with Ongoing. Failed calls are always archived, '
+             'successful ones are sampled.')
+    ongoing_archive_success_rate = fields.Float(
+        string='Archived share of successful calls', default=0.01,
+        help='Between 0 and 1, e.g. 0.01 archives 1% of the successful calls')
+    ongoing_archive_operation_rates = fields.Char(
+        string='Archive rates per operation',
+        help='Comma separated operation=rate overrides, e.g. ProcessOrder=1, GetOrdersByQuery=0.001')
+    ongoing_archive_days = fields.Integer(string='Archive retention (days)', default=30,
+                                          help='0 keeps archived payloads regardless of their age')
+    ongoing_archive_max_mb = fields.Integer(string='Archive size limit (MB)', default=1024,
+                                            help='0 disables the size limit')
+    ongoing_bulk_threshold = fields.Integer(
+        string='Ongoing bulk mode threshold', default=200,
+        help='Batches of at least this many out orders or articles are sent in bulk mode: in chunks, with compiled '
+             'envelopes and more concurrent calls. 0 disables the bulk mode.')
+    ongoing_bulk_chunk_size = fields.Integer(string='Ongoing bulk chunk size', default=500,
+                                             help='Out orders prepared and sent together in bulk mode')
+    ongoing_bulk_concurrency = fields.Integer(
+        string='Ongoing bulk concurrent calls', default=16,
+        help='Maximum number of SOAP calls sent in parallel in bulk mode. Keep the connection pool size at '
+             'least as large.')
+    ongoing_tracking_chunk_size = fields.Integer(
+        string='Ongoing tracking chunk size', default=200,
+        help='Out orders asked for per GetOrdersByQuery call when polling tracking numbers. The calls run with '
+             'up to the maximum concurrent calls in parallel.')
+    ongoing_create_backorders = fields.Boolean(
+        string='Create backorders for partially shipped orders', default=False,
+        help='When Ongoing ships an out order partially, validate the picking and create a backorder for the rest. '
+             'Otherwise the picking stays open until it is validated by hand.')
     last_inbound_sync = fields.Datetime()
     last_return_sync_on = fields.Datetime(tracking=True)
+    last_tracking_sync_on = fields.Datetime(
+        help='Cursor of the tracking change feed: the next poll asks Ongoing for the out orders whose status '
+             'changed since then')
+
+    def write(self, vals):
+        res = super().write(vals)
+        # res.config.settings writes these through its related fields
+        if any(field in vals for field in ONGOING_CLIENT_FIELDS):
+            invalidate_company_clients(self._cr.dbname, self.ids)
+        return res
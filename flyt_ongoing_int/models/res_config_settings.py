@@ -14,3 +14,19 @@ class ResConfigSettings(models.TransientModel):
     ongoing_username = fields.Char(related='company_id.ongoing_username', readonly=False)
     ongoing_password = fields.Char(related='company_id.ongoing_password', readonly=False)
     ongoing_good_owner_code = fields.Char(related='company_id.ongoing_good_owner_code', readonly=False)
+    ongoing_pool_size = fields.Integer(related='company_id.ongoing_pool_size', readonly=False)
+    ongoing_connect_timeout = fields.Float(related='company_id.ongoing_connect_timeout', readonly=False)
+    ongoing_read_timeout = fields.Float(related='company_id.ongoing_read_timeout', readonly=False)
+    ongoing_max_concurrency = fields.Integer(related='company_id.ongoing_max_concurrency', readonly=False)
+    ongoing_compiled_envelopes = fields.Boolean(related='company_id.ongoing_compiled_envelopes', readonly=False)
+    ongoing_log_traffic = fields.Boolean(related='company_id.ongoing_log_traffic', readonly=False)
+    ongoing_archive_payloads = fields.Boolean(related='company_id.ongoing_archive_payloads', readonly=False)
+    ongoing_archive_success_rate = fields.Float(related='company_id.ongoing_archive_success_rate', readonly=False)
+    ongoing_archive_operation_rates = fields.Char(related='company_id.ongoing_archive_operation_rates', readonly=False)
+    ongoing_archive_days = fields.Integer(related='company_id.ongoing_archive_days', readonly=False)
+    ongoing_archive_max_mb = fields.Integer(related='company_id.ongoing_archive_max_mb', readonly=False)
+    ongoing_bulk_threshold = fields.Integer(related='company_id.ongoing_bulk_threshold', readonly=False)
+    ongoing_bulk_chunk_size = fields.Integer(related='company_id.ongoing_bulk_chunk_size', readonly=False)
+    ongoing_bulk_concurrency = fields.Integer(related='company_id.ongoing_bulk_concurrency', readonly=False)
+    ongoing_tracking_chunk_size = fields.Integer(related='company_id.ongoing_tracking_chunk_size', readonly=False)
+    ongoing_create_backorders = fields.Boolean(related='company_id.ongoing_create_backorders', readonly=False)
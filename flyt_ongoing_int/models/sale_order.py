@@ -1,6 +1,11 @@
 from odoo import fields, models, _
 from odoo.exceptions import UserError
-from .ongoing_wms_request import OngoingRequest
+
+# Fields of the order sent in the out orders of its pickings, see
+# StockPicking._enqueue_ongoing_order_updates
+ONGOING_ORDER_FIELDS = {'partner_shipping_id', 'client_order_ref', 'carrier_id', 'flyt_so_ordered_by_contact',
+                        'flyt_so_shipping_street', 'flyt_so_shipping_co_or_company_name',
+                        'flyt_so_shipping_postal_code', 'flyt_so_shipping_city', 'flyt_so_reservation'}
 
 
 class SaleOrder(models.Model):
@@ -14,10 +19,17 @@ class SaleOrder(models.Model):
     flyt_so_shipping_city = fields.Char('Shipping City')
     flyt_so_reservation = fields.Char('Reservation')
 
+    def write(self, vals):
+        result = super().write(vals)
+        if ONGOING_ORDER_FIELDS.intersection(vals):
+            self.picking_ids._enqueue_ongoing_order_updates()
+        return result
+
     def action_confirm(self):
         for order in self:
             order.action_sync_product()
         result = super(SaleOrder, self).action_confirm()
+        self.picking_ids._enqueue_ongoing_out_orders()
         return result
 
     def _check_validation_article(self):
@@ -27,6 +39,7 @@ class SaleOrder(models.Model):
     def _prepare_article_datas(self):
         return [
             {
+                'product_id': l.product_id.id,
                 'name': l.product_id.short_display_name,
                 'default_code': l.product_id.default_code,
                 'barcode': l.product_id.barcode or '',
@@ -34,6 +47,10 @@ class SaleOrder(models.Model):
                 'uom': l.product_uom.name,
             } for l in self.order_line]
 
+    def action_force_sync_product(self):
+        """ Send every article of the order, even the ones Ongoing already has """
+        return self.with_context(ongoing_force_article_sync=True).action_sync_product()
+
     def action_sync_product(self):
         self.ensure_one()
         # don't do anything is ongoing service is not activate on company
@@ -43,14 +60,18 @@ class SaleOrder(models.Model):
         url, username, password, good_owner_code = self._get_ongoing_credential()
         if not username or not password or not good_owner_code:
             raise UserError(_('Credential Missing'))
-        request = OngoingRequest(self.log_xml, url, username, password, good_owner_code)
-        for data in self._prepare_article_datas():
-            response = request.process_article(data)
+        Fingerprint = self.env['ongoing.article.fingerprint']
+        datas = Fingerprint._filter_changed_articles(
+            self.company_id, self._prepare_article_datas(),
+            force=self.env.context.get('ongoing_force_article_sync'))
+        request = self._get_ongoing_request(bulk=self._is_ongoing_bulk(len(datas)))
+        for data, response in zip(datas, request.run_batch('process_article', datas)):
             if not response.get('success'):
                 message = response.get('message', '')
                 if response.get('error_message'):
                     message = message + '\n' + response['error_message']
                 raise UserError(message)
+        Fingerprint._store_articles(self.company_id, datas)
         self.last_sync_on = fields.Datetime.now()
         return {
             'effect': {
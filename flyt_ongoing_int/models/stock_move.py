@@ -1,7 +1,22 @@
 from odoo import models, api, fields, _
-import random
 
 class StockMove(models.Model):
-    _inherit = ['stock.move']
+    _name = 'stock.move'
+    _inherit = ['stock.move', 'ongoing.line.mixin']
 
-    ongoing_line_number = fields.Char('Line number', tracking=True, unique=True, copy=False)
\ No newline at end of file
+    @api.model_create_multi
+    def create(self, vals_list):
+        moves = super().create(vals_list)
+        moves.picking_id._enqueue_ongoing_order_updates()
+        return moves
+
+    def write(self, vals):
+        result = super().write(vals)
+        if 'product_uom_qty' in vals or 'picking_id' in vals:
+            self.picking_id._enqueue_ongoing_order_updates()
+        return result
+
+    def _action_assign(self, force_qty=False):
+        result = super()._action_assign(force_qty=force_qty)
+        self.picking_id._enqueue_ongoing_out_orders()
+        return result
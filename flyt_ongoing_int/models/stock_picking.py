@@ -1,31 +1,56 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import json
 import logging
 from dateutil.relativedelta import relativedelta
 import collections, functools, operator
 from xml.etree import ElementTree
 import lxml.html
-from zeep import helpers
 
 from odoo import models, api, fields, _
 from odoo.exceptions import UserError, ValidationError
-from odoo.tools import float_compare
-from .ongoing_wms_request import OngoingRequest
+from odoo.tools import float_compare, split_every
 from markupsafe import Markup
 from psycopg2.errors import UniqueViolation
 
+from .ongoing_order_stream import OrderState, SHIPPED_STATUS
+
 _logger = logging.getLogger(__name__)
 
 TRACKED_ITEMS = ['FH8071']
+# Fields of the picking sent in its out order, see _enqueue_ongoing_order_updates
+ONGOING_ORDER_FIELDS = {'scheduled_date', 'note'}
+# Times a tracking poll chunk is asked for before giving up until the next run
+TRACKING_POLL_ATTEMPTS = 3
+# Minutes the tracking change feed reads again before its cursor
+TRACKING_CURSOR_OVERLAP = 5
+# Relations the out order payloads read, loaded for a whole batch of
+# pickings at once, see _prepare_out_order_datas_batch
+OUT_ORDER_PREFETCH = (
+    'sale_id.partner_shipping_id.parent_id.country_id.code',
+    'sale_id.partner_shipping_id.country_id.code',
+    'sale_id.flyt_so_ordered_by_contact.parent_id.name',
+    'sale_id.carrier_id.fh_transport_service_code',
+    'sale_id.company_id.ongoing_use_shipping_name',
+    'carrier_id.fh_transport_service_code',
+    'move_ids.move_dest_ids.picking_id.name',
+    'move_ids_without_package.move_line_ids.product_id.default_code',
+)
 
 
 class StockPicking(models.Model):
     _name = 'stock.picking'
     _inherit = ['stock.picking', 'ongoing.logger.mixin']
 
-    ongoing_order_id = fields.Char(copy=False)
+    ongoing_order_id = fields.Char(copy=False, index=True)
     ongoing_goods_info = fields.Integer(copy=False)
+    ongoing_status = fields.Char('Ongoing status', copy=False, help='Status of the out order at the last tracking poll')
+    ongoing_tracking_hash = fields.Char(copy=False, help='Hash of the status, tracking number, URLs, collo count and '
+                                                          'serials of the last tracking poll, so that an unchanged '
+                                                          'order is not processed again')
+    ongoing_sent_snapshot = fields.Text(copy=False, help='What the out order looked like when it was last sent to '
+                                                         'Ongoing, so that only the changes are sent next time')
     flyt_location_dest_id_usage = fields.Selection(related='location_dest_id.usage', store=True)
 
     ongoing_sync_serial_numbers = fields.Boolean(related='company_id.ongoing_sync_serial_numbers', store=False)
@@ -80,7 +105,7 @@ class StockPicking(models.Model):
         url, username, password, good_owner_code = self._get_ongoing_credential()
         if not username or not password or not good_owner_code:
             raise UserError(_('Credential Missing'))
-        request = OngoingRequest(self.log_xml, url, username, password, good_owner_code)
+        request = self._get_ongoing_request()
 
         ##### Denne har utgåande også... internal_transfer = self.move_ids.move_dest_ids.mapped('picking_id') ## self = INT transfer
         internal_transfer = self.move_ids.move_dest_ids.filtered(lambda p: p.picking_type_id.code == 'internal').mapped('picking_id')
@@ -150,7 +175,7 @@ class StockPicking(models.Model):
         if not username or not password or not good_owner_code:
             _logger.info('Ongoing: Credential Missing: Company :: {}'.format(self.env.company.name))
             return True
-        request = OngoingRequest(self.log_xml, url, username, password, good_owner_code)
+        request = self._get_ongoing_request()
         data = self._prepare_get_inbound_order_datas()
         try:
             response = request.get_inbound_order(data)
@@ -224,53 +249,186 @@ class StockPicking(models.Model):
     # GET Out Order Transaction
     # -----------------------
 
-    def _get_ongoing_pickings(self):
-        return self.search([('ongoing_order_id', '!=', False),
-                            ('sale_id', '!=', False),
-                            ('picking_type_id.code', '=', 'outgoing'),
-                            ('state', '=', 'assigned')])
+    def _ongoing_pickings_domain(self):
+        """ Open out pickings sent to Ongoing """
+        return [('ongoing_order_id', '!=', False),
+                ('sale_id', '!=', False),
+                ('picking_type_id.code', '=', 'outgoing'),
+                ('state', '=', 'assigned')]
+
+    def _get_ongoing_pickings(self, domain=None):
+        return self.search(self._ongoing_pickings_domain() + (domain or []))
 
     def _prepare_move_type(self, move_type):
         return (move_type, dict(self._fields['move_type'].selection).get(move_type))
 
     def _prepare_out_order_datas(self):
-        internal_transfer = self.move_ids.move_dest_ids.mapped('picking_id')
-        order_items = self.env['stock.move.line'].search([['picking_id', '=', self.id]])
-        if not order_items:
-            # last part is new
-            order_items = self.move_ids_without_package.move_line_ids or self.move_ids_without_package
+        self.ensure_one()
+        return self._prepare_out_order_datas_batch()[self.id]
 
+    def _prepare_out_order_datas_batch(self):
+        """ Out order datas of every picking, by picking id.
 
-        data = {
-            'sale_id' : self.sale_id,
-            'picking_id' : self,
-            'order_items': order_items,
-            'reference': internal_transfer.name if internal_transfer and len(internal_transfer) == 1 else self.name,
-            'in_date': self.scheduled_date or '',
-            'move_type': self._prepare_move_type(self.move_type),
-            'remark': lxml.html.fromstring(self.note).text_content() if self.note else '',
-            'carrier': self.carrier_id and (self.carrier_id.transport_service_code, self.carrier_id.name)
-        }
-        return data
+            What the payloads read (move lines, sale orders, shipping
+            partners and their parents, countries, carriers) is loaded for
+            the whole batch with a few grouped reads first, so the number of
+            queries does not grow with the number of pickings.
+        """
+        for path in OUT_ORDER_PREFETCH:
+            self.mapped(path)
+        move_lines = self.env['stock.move.line'].search([('picking_id', 'in', self.ids)])
+        move_lines.mapped('product_id.default_code')
+        order_items = move_lines.grouped('picking_id')
+        # Notes are often copied from the same template
+        remarks = {}
+
+        datas = {}
+        for picking in self:
+            internal_transfer = picking.move_ids.move_dest_ids.picking_id
+            items = order_items.get(picking)
+            if not items:
+                # last part is new
+                items = picking.move_ids_without_package.move_line_ids or picking.move_ids_without_package
+            note = picking.note
+            if note and note not in remarks:
+                remarks[note] = lxml.html.fromstring(note).text_content()
+            datas[picking.id] = {
+                'sale_id': picking.sale_id,
+                'picking_id': picking,
+                'order_items': items,
+                'reference': internal_transfer.name if internal_transfer and len(internal_transfer) == 1 else picking.name,
+                'in_date': picking.scheduled_date or '',
+                'move_type': picking._prepare_move_type(picking.move_type),
+                'remark': remarks[note] if note else '',
+                'carrier': picking.carrier_id and (picking.carrier_id.transport_service_code, picking.carrier_id.name)
+            }
+        return datas
+
+    def init(self):
+        super().init()
+        # Candidates of send_to_ongoing, with the predicate of _get_pickings_to_send.
+        # It replaces stock_picking_ongoing_to_send_index, which missed ongoing_order_id = ''
+        self.env.cr.execute("DROP INDEX IF EXISTS stock_picking_ongoing_to_send_index")
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS stock_picking_ongoing_unsent_index
+                ON stock_picking (id)
+             WHERE state = 'assigned' AND sale_id IS NOT NULL
+               AND (ongoing_order_id IS NULL OR ongoing_order_id = '')
+        """)
+
+    @api.model
+    def _get_pickings_to_send(self, picking_ids=None):
+        """ Assigned outgoing sale pickings not sent to Ongoing yet, split on
+            whether all their moves are fully reserved, in one query
+            @param picking_ids: only consider these pickings
+            @return: (pickings ready to send, names of the other ones)
+        """
+        self.env['stock.move'].flush_model(['picking_id', 'product_uom_qty', 'quantity'])
+        self.flush_model(['state', 'sale_id', 'picking_type_id', 'ongoing_order_id'])
+        # A picking is ready when every move is fully reserved. Since Odoo 17 the
+        # reserved quantity of a move is quantity (reserved_availability is gone),
+        # in the unit of measure of the move like product_uom_qty, and both are
+        # rounded to the same precision when stored, so they compare as equal.
+        self.env.cr.execute("""
+            SELECT picking.id, picking.name, COALESCE(bool_and(move.product_uom_qty = move.quantity), TRUE)
+              FROM stock_picking picking
+              JOIN stock_picking_type picking_type ON picking_type.id = picking.picking_type_id
+         LEFT JOIN stock_move move ON move.picking_id = picking.id
+             WHERE picking.state = 'assigned'
+               AND picking.sale_id IS NOT NULL
+               AND picking_type.code = 'outgoing'
+               AND (picking.ongoing_order_id IS NULL OR picking.ongoing_order_id = '')
+               AND (%s::int[] IS NULL OR picking.id = ANY(%s::int[]))
+          GROUP BY picking.id
+          ORDER BY picking.id
+        """, [picking_ids, picking_ids])
+        ready_ids, skipped = [], []
+        for picking_id, name, ready in self.env.cr.fetchall():
+            if ready:
+                ready_ids.append(picking_id)
+            else:
+                skipped.append(name)
+        return self.browse(ready_ids), skipped
 
     def send_to_ongoing(self):
-        pickings = self.search([('state', '=', 'assigned'),
-                                ('sale_id', '!=', False),
-                                ('picking_type_id.code', '=', 'outgoing'),
-                                ('ongoing_order_id', '=', False)])
+        pickings, skipped = self._get_pickings_to_send()
+        if skipped:
+            _logger.info('An ordered product is not in stock. Skipping these transfers - %s.', ', '.join(skipped))
         _logger.info('Attempting to send these pickings to Ongoing: ')
         _logger.info(pickings)
-        for record in pickings:
-            _logger.info(record)
-            cannot_send = False
-            for line in record.move_ids:
-                # TODO Verify this, used to be product_uom_qty != reserved_availability
-                if line.product_uom_qty != line.quantity:
-                    cannot_send = True
-            if cannot_send:
-                _logger.info('An ordered product is not in stock. Skipping this transfer - %s.', record.name)
-            else:
-                record.action_sync_so_order()
+        for company in pickings.company_id:
+            pickings.filtered(lambda p: p.company_id == company).with_company(company)._dispatch_out_orders()
+
+    def _enqueue_ongoing_out_orders(self):
+        """ Queue the sending of the assigned outgoing sale pickings """
+        pickings = self.filtered(lambda p: p.state == 'assigned' and p.sale_id and p.picking_type_code == 'outgoing'
+                                 and not p.ongoing_order_id)
+        self.env['ongoing.job']._enqueue('out_order', pickings)
+
+    def _dispatch_out_orders(self):
+        """ Send the out orders of these pickings, all of one company, with
+            at most ongoing_max_concurrency ProcessOrder calls in flight.
+
+            The payloads are prepared here, then sent from worker threads
+            (see OngoingRequest.run_batch). Each answer is written back in
+            its own savepoint and committed, so a failing picking neither
+            blocks the others nor rolls back the orders Ongoing already has.
+            Large batches are sent in bulk mode, see _is_ongoing_bulk.
+            @return: dict picking id -> error, for the pickings not sent
+        """
+        url, username, password, good_owner_code = self._get_ongoing_credential()
+        if not username or not password or not good_owner_code:
+            _logger.info('Ongoing: Credential Missing: Company :: {}'.format(self.env.company.name))
+            return dict.fromkeys(self.ids, _('Credential Missing'))
+        if not self._is_ongoing_bulk(len(self)):
+            return self._send_out_orders(self._get_ongoing_request())
+
+        # Bulk mode: prepare and send chunk after chunk, so that memory and
+        # the cache stay bounded whatever the number of pickings
+        request = self._get_ongoing_request(bulk=True)
+        company = self.company_id[:1] or self.env.company
+        chunk_size = company.ongoing_bulk_chunk_size or len(self)
+        _logger.info('Ongoing: sending %s out orders in bulk mode, by chunks of %s', len(self), chunk_size)
+        errors = {}
+        for chunk in split_every(chunk_size, self.ids, self.browse):
+            errors.update(chunk._send_out_orders(request))
+            self.env.invalidate_all()
+        return errors
+
+    def _send_out_orders(self, request):
+        """ See _dispatch_out_orders """
+        cr = self.env.cr
+        datas = self._prepare_out_order_datas_batch()
+        pickings, payloads, snapshots, errors = [], [], [], {}
+        for picking in self:
+            data = datas[picking.id]
+            try:
+                with cr.savepoint():
+                    payload, snapshot = request.prepare_order_payload(data)
+            except Exception as e:
+                _logger.exception('Ongoing: Failed to prepare out order %s :: %s', picking.name, e)
+                errors[picking.id] = str(e)
+                continue
+            pickings.append(picking)
+            payloads.append(payload)
+            snapshots.append(snapshot)
+
+        responses = request.run_batch('send_prepared_order', payloads, return_exceptions=True)
+        for picking, response, snapshot in zip(pickings, responses, snapshots):
+            if isinstance(response, Exception):
+                _logger.error('Ongoing: Failed to connect! :: %s :: %s', picking.name, response)
+                errors[picking.id] = str(response)
+                continue
+            try:
+                with cr.savepoint():
+                    error = picking._write_out_order_response(response, snapshot)
+            except Exception as e:
+                _logger.exception('Ongoing: Failed to save the out order of %s :: %s', picking.name, e)
+                error = str(e)
+            if error:
+                errors[picking.id] = error
+            cr.commit()
+        return errors
 
     def action_sync_so_order(self):
         if self.ongoing_order_id:
@@ -281,65 +439,257 @@ class StockPicking(models.Model):
         if not username or not password or not good_owner_code:
             _logger.info('Ongoing: Credential Missing: Company :: {}'.format(self.env.company.name))
             return True
-        request = OngoingRequest(self.log_xml, url, username, password, good_owner_code)
+        request = self._get_ongoing_request()
         data = self._prepare_out_order_datas()
         try:
-            response = request._prepare_process_order(data)
-            _logger.debug(response)
+            payload, snapshot = request.prepare_order_payload(data)
+            response = request.send_prepared_order(payload)
+            self._write_out_order_response(response, snapshot)
+        except Exception as e:
+            _logger.exception('Ongoing: Failed to connect! :: %s', e)
+        return True
+
+    def _write_out_order_response(self, response, snapshot=None):
+        """ Record the ProcessOrder answer on the picking
+            @param snapshot: OngoingRequest.order_snapshot of the order sent
+            @return: the error message if Ongoing refused the order, else False
+        """
+        _logger.debug(response)
+        if not response.get('success'):
+            message = response.get('message', '')
+            if response.get('error_message'):
+                message = message + '\n' + response['error_message']
+            _logger.info('Ongoing: Failed to Sync sale order :: {}'.format(message))
+            return message or _('Ongoing refused the order')
+        self.last_sync_on = fields.Datetime.now()
+        title = _('Synced with Ongoing WMS')
+        message = Markup('<strong>{}</strong> <br/> <strong>Order ID :: </strong> {} <br/> <strong>Message ::</strong> {}'.format(title, response.get('order_id', ''), response.get('message', '')))
+        self.ongoing_order_id = response.get('order_id', '')
+        if snapshot:
+            self.ongoing_sent_snapshot = json.dumps(snapshot)
+        self.message_post(body=message)
+        return False
+
+    def write(self, vals):
+        result = super().write(vals)
+        if ONGOING_ORDER_FIELDS.intersection(vals):
+            self._enqueue_ongoing_order_updates()
+        return result
+
+    def _enqueue_ongoing_order_updates(self):
+        """ Queue pushing the changes of the out orders already in Ongoing """
+        pickings = self.filtered(lambda p: p.ongoing_order_id and p.ongoing_sent_snapshot
+                                 and p.state not in ('done', 'cancel'))
+        self.env['ongoing.job']._enqueue('out_order_update', pickings)
+
+    def action_update_ongoing_order(self):
+        self.ensure_one()
+        if not self.ongoing_order_id:
+            _logger.info("Trying to update order that's not shipped")
+            raise ValidationError(_("Not shipped"))
+        self._push_ongoing_order_changes()
+        return True
+
+    def _push_ongoing_order_changes(self):
+        """ Send Ongoing what changed on the out order since it was last
+            sent: UpdateOrder for the header fields and UpdateOrderLines for
+            the quantities, or ProcessOrder again when lines were added.
+            Raise a UserError when Ongoing refuses the changes.
+        """
+        self.ensure_one()
+        if not self.ongoing_order_id or not self.ongoing_sent_snapshot or self.state in ('done', 'cancel'):
+            return True
+        url, username, password, good_owner_code = self._get_ongoing_credential()
+        if not username or not password or not good_owner_code:
+            raise UserError(_('Credential Missing'))
+        request = self._get_ongoing_request()
+        data = self._prepare_out_order_datas()
+        payload, snapshot = request.prepare_order_payload(data)
+        update, lines, added = request.order_changes(json.loads(self.ongoing_sent_snapshot), snapshot)
+
+        def check(response):
             if not response.get('success'):
-                message = response.get('message', '')
+                message = response.get('message') or _('Ongoing refused the changes')
                 if response.get('error_message'):
                     message = message + '\n' + response['error_message']
-                _logger.info('Ongoing: Failed to Sync sale order :: {}'.format(message))
-                return True
-            self.last_sync_on = fields.Datetime.now()
-            title = _('Synced with Ongoing WMS')
-            message = Markup('<strong>{}</strong> <br/> <strong>Order ID :: </strong> {} <br/> <strong>Message ::</strong> {}'.format(title, response.get('order_id', ''), response.get('message', '')))
-            self.ongoing_order_id = response.get('order_id', '')
-            self.message_post(body=message)
-        except Exception as e:
-            _logger.exception('Ongoing: Failed to connect! :: %s', e)
+                raise UserError(message)
+
+        sent = []
+        if added:
+            check(request.send_prepared_order(payload))
+            sent.append(_('whole order'))
+        elif update:
+            check(request.update_order(self.ongoing_order_id, update))
+            sent += [key[len('UpdateOrder'):] for key in update]
+        if lines:
+            check(request.update_order_lines(self.ongoing_order_id, lines))
+            sent.append(_('%s lines', len(lines)))
+        if not sent:
+            return True
+        self.ongoing_sent_snapshot = json.dumps(snapshot)
+        self.last_sync_on = fields.Datetime.now()
+        title = _('Updated in Ongoing WMS')
+        self.message_post(body=Markup('<strong>{}</strong> <br/> {}'.format(title, ', '.join(sent))))
         return True
 
-    def _set_tracking_number(self):
+    def _set_tracking_number(self, commit=True):
         """
-        Retrieve tracking numbers for today's orders from Ongoing
-        :return: None
+        Retrieve tracking numbers of the open out orders of these pickings, all
+        of one company, from Ongoing.
+
+        The order ids are asked for by chunks of ongoing_tracking_chunk_size,
+        with at most ongoing_max_concurrency calls in flight. The answer of
+        each chunk is applied, and committed unless commit is False, as soon
+        as it arrives, and a failed chunk is asked for again on its own.
+        :return: whether the tracking of every picking was updated
         """
 
         url, username, password, good_owner_code = self._get_ongoing_credential()
         if not username or not password or not good_owner_code:
             _logger.info('Ongoing: Credential Missing: Company :: {}'.format(self.env.company.name))
-            return True
-
-        request = OngoingRequest(self.log_xml, url, username, password, good_owner_code)
-        pickings = self._get_ongoing_pickings()
-        ongoing_response = request._prepare_get_orders_by_query(pickings)
+            return False
 
+        request = self._get_ongoing_request()
+        pickings = self.filtered_domain(self._ongoing_pickings_domain())
+        picking_ids = {int(picking.ongoing_order_id): picking.id for picking in pickings}
+        chunk_size = (self.company_id[:1] or self.env.company).ongoing_tracking_chunk_size or len(picking_ids) or 1
+        chunks = [list(chunk) for chunk in split_every(chunk_size, picking_ids)]
+
+        applied = True
+        for attempt in range(1, TRACKING_POLL_ATTEMPTS + 1):
+            failed = []
+            for order_ids, order_states in request.iter_batch('fetch_orders', chunks, return_exceptions=True):
+                if isinstance(order_states, Exception):
+                    _logger.warning('Ongoing: Failed to get %s orders (attempt %s/%s) :: %s',
+                                    len(order_ids), attempt, TRACKING_POLL_ATTEMPTS, order_states)
+                    failed.append(order_ids)
+                    continue
+                chunk = self.browse([picking_ids[order_id] for order_id in order_ids])
+                applied = chunk._apply_tracking_orders(order_states, commit=commit) and applied
+            chunks = failed
+            if not chunks:
+                break
+        if chunks:
+            _logger.error('Ongoing: Failed to connect! :: tracking of %s orders not updated',
+                          sum(len(chunk) for chunk in chunks))
+        return applied and not chunks
+
+    def _apply_tracking_orders(self, order_states, commit=True):
+        """ Update these pickings from the states of their orders (index order
+            id -> OrderState) and commit, unless commit is False
+            @return: False when the update failed and was rolled back
+        """
         try:
-            ongoing_order_ids = [picking.ongoing_order_id for picking in self]
-            if ongoing_order_ids and ongoing_response and ongoing_response.get('response'):
-                response_dict = helpers.serialize_object(ongoing_response['response'], dict)
-                picking_map = request.parse_tracking_numbers(response_dict)
-                pickings._update_tracking_ref(picking_map)
-                pickings._update_serial_number_line(picking_map)
-                pickings._update_tracking_url(picking_map)
-                pickings._update_goods_info(picking_map)
+            with self.env.cr.savepoint():
+                states = self._get_order_states(order_states)
+                hashes = {picking_id: state.tracking_fingerprint() for picking_id, state in states.items()}
+                changed = self.filtered(lambda p: p.ongoing_tracking_hash != hashes[p.id])
+                changed._update_tracking_ref(states)
+                changed._update_serial_number_line(states)
+                changed._update_tracking_url(states)
+                changed._update_goods_info(states)
+                for picking in changed:
+                    picking.write({
+                        'ongoing_status': states[picking.id].status,
+                        'ongoing_tracking_hash': hashes[picking.id],
+                    })
+                # Shipped at a previous poll which could not validate them. Without
+                # backorders, partial shipments are left open on purpose: they are
+                # only validated again once their order changes in Ongoing.
+                (self - changed).filtered(
+                    lambda p: p.state == 'assigned' and p.ongoing_status == SHIPPED_STATUS and p.carrier_tracking_ref
+                    and p.company_id.ongoing_create_backorders
+                )._validate_shipped_pickings()
         except Exception as e:
-            _logger.info('Ongoing: Failed to connect! :: {}'.format(str(e)))
-        return True
+            _logger.exception('Ongoing: Failed to update the tracking of %s :: %s', ', '.join(self.mapped('name')), e)
+            applied = False
+        else:
+            applied = True
+        if commit:
+            self.env.cr.commit()
+        return applied
+
+    def _get_order_states(self, order_states):
+        """ picking id -> OrderState of its order in order_states, an empty
+            state when Ongoing did not return it """
+        states = {}
+        for picking in self:
+            order_id = int(picking.ongoing_order_id)
+            states[picking.id] = order_states.get(order_id) or OrderState(order_id)
+        return states
+
+    def _cron_set_tracking_number(self, full=False):
+        """ Poll the tracking of the open out orders: only the ones whose
+            status changed since the last poll (see _sync_tracking_changes),
+            or all of them with full """
+        if not full:
+            companies = self.env['res.company'].search([('activate_ongoing', '=', True)])
+            for company in companies:
+                self.with_company(company)._sync_tracking_changes()
+            return
 
-    def _cron_set_tracking_number(self):
         pickings = self._get_ongoing_pickings()
         _logger.info('Found these pickings')
         _logger.info(pickings)
-        pickings._set_tracking_number()
+        for company in pickings.company_id:
+            pickings.filtered(lambda p: p.company_id == company).with_company(company)._set_tracking_number()
+
+    @api.model
+    def _sync_tracking_changes(self):
+        """
+        Change feed of the tracking poll: ask Ongoing for the out orders whose
+        status changed since the cursor of the company (last_tracking_sync_on)
+        and update their open pickings only, so that a run costs the number of
+        changes rather than the number of open orders.
+
+        The first run of a company, without cursor, polls all its open orders.
+        The cursor only moves forward once every change is applied, with an
+        overlap for the orders changing while the previous run was reading: a
+        chunk failing to apply is read again at the next run.
+        :return: None
+        """
+        company = self.env.company
+        url, username, password, good_owner_code = self._get_ongoing_credential()
+        if not username or not password or not good_owner_code:
+            _logger.info('Ongoing: Credential Missing: Company :: {}'.format(company.name))
+            return True
+
+        started = fields.Datetime.now()
+        if not company.last_tracking_sync_on:
+            applied = self._get_ongoing_pickings([('company_id', '=', company.id)])._set_tracking_number()
+        else:
+            request = self._get_ongoing_request()
+            since = company.last_tracking_sync_on - relativedelta(minutes=TRACKING_CURSOR_OVERLAP)
+            try:
+                order_states = request.parse_order_states(
+                    request.stream_orders(status_changed_from=since, raise_errors=True))
+            except Exception as e:
+                _logger.warning('Ongoing: Failed to get the orders changed since %s :: %s', since, e)
+                return True
+            pickings = self._get_ongoing_pickings([
+                ('company_id', '=', company.id),
+                ('ongoing_order_id', 'in', [str(order_id) for order_id in order_states]),
+            ])
+            _logger.info('Ongoing: %s orders changed since %s, %s open pickings to update',
+                         len(order_states), since, len(pickings))
+            chunk_size = company.ongoing_tracking_chunk_size or len(pickings) or 1
+            applied = True
+            for chunk in split_every(chunk_size, pickings.ids, self.browse):
+                applied = chunk._apply_tracking_orders(order_states) and applied
+        if not applied:
+            _logger.warning('Ongoing: tracking changes not all applied, the cursor stays at %s',
+                            company.last_tracking_sync_on)
+            return True
+        company.last_tracking_sync_on = started
+        self.env.cr.commit()
+        return True
 
     def action_set_tracking_number(self):
         if not self.ongoing_order_id:
             _logger.info("Trying to ship order that's not shipped")
             raise ValidationError(_("Not shipped"))
-        self._set_tracking_number()
+        # Within the transaction of the button
+        self._set_tracking_number(commit=False)
         title = _('Get Tracking Number')
         message = Markup('<strong>{}</strong> <br/> <strong>Tracking Number :: </strong> {}'.format(title, self.carrier_tracking_ref))
         self.message_post(body=message)
@@ -350,11 +700,10 @@ class StockPicking(models.Model):
             return
 
         url, username, password, good_owner_code = self._get_ongoing_credential()
-        request = OngoingRequest(self.log_xml, url, username, password, good_owner_code)
+        request = self._get_ongoing_request()
         pickings = self._get_ongoing_pickings()
-        serial_no_list = pickings._get_serial_numbers(request)
-        picking_map = self._prepare_picking_map(serial_no_list)
-        pickings._update_serial_number_line(picking_map)
+        order_states = pickings._get_serial_numbers(request)
+        pickings._update_serial_number_line(pickings._get_order_states(order_states))
 
     def action_set_serial_number(self):
         company = self.company_id or self.env.company
@@ -362,73 +711,104 @@ class StockPicking(models.Model):
             return
 
         url, username, password, good_owner_code = self._get_ongoing_credential()
-        request = OngoingRequest(self.log_xml, url, username, password, good_owner_code)
+        request = self._get_ongoing_request()
         if not self.ongoing_order_id:
             _logger.info("Trying to ship order that's not shipped")
             raise ValidationError(_("Not shipped"))
-        serial_no_list = self._get_serial_numbers(request)
-        picking_map = self._prepare_picking_map(serial_no_list)
-        self._update_serial_number_line(picking_map)
+        order_states = self._get_serial_numbers(request)
+        self._update_serial_number_line(self._get_order_states(order_states))
 
     def _get_serial_numbers(self, request):
+        """ Index order id -> shipped OrderState with the picked serials, for
+            the orders of these pickings that have some """
         res = {}
-        for picking in self:
-            response = request._get_serial_numbers_ongoing(int(picking.ongoing_order_id))
+        order_ids = [int(picking.ongoing_order_id) for picking in self]
+        responses = request.run_batch('_get_serial_numbers_ongoing', order_ids)
+        for picking, response in zip(self, responses):
             if not response.get('success', False):
                 _logger.info(f"Not Synced with Ongoing WMS For Ongoing_Order_id: {picking.ongoing_order_id} \n {response.get('message', ' ')}")
                 continue
             if response.get('serial_no_list', False):
-                res= {int(picking.ongoing_order_id): response.get('serial_no_list', False)}
+                order_id = int(picking.ongoing_order_id)
+                res[order_id] = OrderState(order_id, SHIPPED_STATUS, serials=response['serial_no_list'])
         return res
 
-    def _prepare_picking_map(self, serial_no_list):
-        ongoing_order_dict = {ongoing_id:'Sendt' for ongoing_id, serialno in serial_no_list.items()}
-        serial_no_dict = {ongoing_id:serialno for ongoing_id, serialno in serial_no_list.items()}
-        return {'status': ongoing_order_dict, 'serial': serial_no_dict}
-
-    def _update_tracking_ref(self, picking_map):
+    def _update_tracking_ref(self, states):
+        shipped = self.browse()
         for picking in self:
-            order_id = int(picking.ongoing_order_id)
-            tracking_id =  picking_map['status'].get(order_id) == 'Sendt' and \
-                picking_map.get('tracking') and picking_map.get('tracking').get(order_id, False)
+            state = states[picking.id]
+            tracking_id = state.shipped and state.tracking
             if tracking_id:
-                picking.carrier_tracking_ref = tracking_id
-                # Since it has a tracking this means it has been sent. So we validate it.
-                picking.button_validate()
-
-    def _update_goods_info(self, picking_map):
+                if picking.carrier_tracking_ref != tracking_id:
+                    picking.carrier_tracking_ref = tracking_id
+                shipped |= picking
+        # Since they have a tracking this means they have been sent. So we validate them.
+        shipped._validate_shipped_pickings()
+
+    def _validate_shipped_pickings(self):
+        """ Validate the pickings Ongoing shipped with one button_validate
+            call. When some were shipped partially, the backorder wizard is
+            answered once for all of them if the companies create backorders
+            (ongoing_create_backorders), otherwise those pickings are left
+            open as before. When the batch cannot be validated at once, the
+            pickings are validated one by one. """
+        if not self:
+            return
+        try:
+            with self.env.cr.savepoint():
+                res = self.button_validate()
+                if isinstance(res, dict) and res.get('res_model') == 'stock.backorder.confirmation' \
+                        and all(self.mapped('company_id.ongoing_create_backorders')):
+                    backorder_wizard = self.env['stock.backorder.confirmation'].with_context(res['context']).create(
+                        {'pick_ids': [(4, picking.id) for picking in self]})
+                    res = backorder_wizard.process()
+        except Exception as e:
+            res = e
+        if not isinstance(res, (dict, Exception)):
+            return
+        if len(self) > 1:
+            _logger.info('Ongoing: Failed to validate %s pickings at once, validating them one by one :: %s',
+                         len(self), res)
+            for picking in self:
+                picking._validate_shipped_pickings()
+        elif isinstance(res, Exception):
+            _logger.warning('Ongoing: Failed to validate %s :: %s', self.name, res)
+        else:
+            _logger.warning('Ongoing: %s not validated, %s has to be answered by hand', self.name, res.get('res_model'))
+
+    def _update_goods_info(self, states):
         for picking in self:
-            order_id = int(picking.ongoing_order_id)
-            goods_info =  picking_map['status'].get(order_id) == 'Sendt' and \
-                picking_map.get('goods_info') and picking_map.get('goods_info').get(order_id, False)
-            if not goods_info:
+            state = states[picking.id]
+            if not state.shipped or not state.collo_count:
                 continue
 
             _logger.debug('Setting goods_info for %s', picking.name)
-            ant_kolli = len(goods_info)
-            picking.ongoing_goods_info = ant_kolli
+            ant_kolli = state.collo_count
+            if picking.ongoing_goods_info != ant_kolli:
+                picking.ongoing_goods_info = ant_kolli
 
 
-    def _update_tracking_url(self, picking_map):
+    def _update_tracking_url(self, states):
+        bodies = {}
         for picking in self:
-            order_id = int(picking.ongoing_order_id)
-            tracking_url =  picking_map['status'].get(order_id) == 'Sendt' and \
-                picking_map.get('tracking_url') and picking_map.get('tracking_url').get(order_id, False)
+            state = states[picking.id]
+            tracking_url = state.shipped and state.tracking_urls
             if tracking_url:
-                picking.message_post(body=Markup(
-                    f'Antall kolli {len(tracking_url)}'))
                 links = '&nbsp;'.join([f'<a href="{url}">{url}</a>' for url in tracking_url])
-                picking.message_post(body=Markup(
-                    f'Tracking URL {links}'))
+                bodies[picking.id] = Markup(
+                    f'Antall kolli {len(tracking_url)}<br/>Tracking URL {links}')
+        # One message per picking, all created at once
+        if bodies:
+            self.browse(list(bodies))._message_log_batch(bodies)
 
-    def _update_serial_number_line(self, picking_map):
+    def _update_serial_number_line(self, states):
         for picking in self:
             if not picking.company_id.ongoing_sync_serial_numbers:
                 continue
 
-            order_id = int(picking.ongoing_order_id)
-            if picking_map['status'].get(order_id) == 'Sendt':
-                update_sr_qty_list = picking_map['serial'][order_id]
+            state = states[picking.id]
+            if state.shipped:
+                update_sr_qty_list = state.serials
                 product_code_list = tuple(map(lambda x:x.get('default_code'),  update_sr_qty_list))
                 serial_no_list = tuple(map(lambda x:x.get('serial'), filter(lambda x:x.get('serial'), update_sr_qty_list)))
                 serial_no_wo_list = list(filter(lambda x:not x.get('serial'), update_sr_qty_list))
@@ -533,19 +913,6 @@ class StockPicking(models.Model):
                 return True
         return False
 
-    def process_return_cause(self, order, ret_article_syscode):
-        pi = order['PickedArticleItems'] and order['PickedArticleItems']['PickedArticleItem']
-        if not pi:
-            return None
-        #picked_article = [x for x in pi if x['Article']['SystemId'] == ret_article_syscode]
-        #OrderLineSystemId
-        picked_article = [x for x in pi if x['OrderLineSystemId'] == ret_article_syscode]
-        causes = [x['ReturnCauseName'] for x in picked_article if x['ReturnCauseName']]
-        if not any(causes):
-            return None
-
-        return [x for x in causes if x][0]
-
     def _prepare_picking_default_values(self, src_picking):
         """ Shamelessly copied from stock_picking_return.py """
         assert src_picking.picking_type_id, 'Picking %s no picking type' % src_picking.name
@@ -565,53 +932,54 @@ class StockPicking(models.Model):
             vals['location_dest_id'] = src_picking.location_id.id
         return vals
 
-    def get_return_pickings(self, orders):
+    def get_return_pickings(self, order_states):
+        """ picking -> list of (line number, returned quantity, move, return
+            cause) of the returned lines of order_states (index order id ->
+            OrderState). The moves of all the lines are searched at once. """
         pickings = {}
-        for order in orders['Order']:
-            orderid = order['OrderInfo']['OrderId']
-            picked = order['PickedOrderLines']
-            if not picked:
+        returns = []
+        for state in order_states.values():
+            if not state.returns:
                 continue
-            returns = [(x['Article'], x['ExternalOrderLineCode'], x['ReturnedNumberOfItems'], x['OrderLineSystemId'])
-                       for x in picked['PickedOrderLine']]
             # artikkel = SystemId Name ArticleNumber
-            _logger.info('Returns for order %s is %s', orderid, returns)
+            _logger.info('Returns for order %s is %s', state.order_id, state.returns)
 
-            for ret in returns:
-                #ret_article_syscode = ret[0]['SystemId']
-                ret_article_syscode = ret[3]
-                ret_cause = self.process_return_cause(order, ret_article_syscode)
-
-                if not ret[1] or ret[1]=='False':
+            for ret in state.returns:
+                if not ret.line_code or ret.line_code == 'False':
                     _logger.error('No external order line code')
                     continue
 
-                #if ret[1] in created_lines:
-                #    _logger.error('More than one %d', ret[1])
-                #    continue
-
-                if not ret[2]:
+                if not ret.quantity:
                     _logger.info('Returned quantity is 0')
                     continue
+                returns.append(ret)
+
+        line_codes = {ret.line_code for ret in returns}
+        moves = self.env['stock.move'].search([('ongoing_line_number', 'in', list(line_codes))]).grouped(
+            'ongoing_line_number')
+        missing_codes = line_codes - set(moves)
+        move_lines = missing_codes and self.env['stock.move.line'].search(
+            [('ongoing_line_number', 'in', list(missing_codes))]).grouped('ongoing_line_number') or {}
+
+        for ret in returns:
+            move = moves.get(ret.line_code)
+            if not move:
+                _logger.info('Move with ongoing number %s not found, looking for moveline' % ret.line_code)
+                line = move_lines.get(ret.line_code)
+                if not line:
+                    _logger.error('Move Line with ongoing number %s not found either' % ret.line_code)
+                    continue
+                else:
+                    move = line.move_id
+            if len(move) > 1:
+                _logger.info('More than one order line with ongoing number %s found: %s', ret.line_code, move)
+                raise ValidationError(_('More than one order line with ongoing numer %s found') % ret.line_code)
 
-                move = self.env['stock.move'].search([('ongoing_line_number', '=', ret[1])])
-                if not move:
-                    _logger.info('Move with ongoing number %s not found, looking for moveline' % ret[1])
-                    line = self.env['stock.move.line'].search([('ongoing_line_number', '=', ret[1])])
-                    if not line:
-                        _logger.error('Move Line with ongoing number %s not found either' % ret[1])
-                        continue
-                    else:
-                        move = line.move_id
-                if len(move) > 1:
-                    _logger.info('More than one order line with ongoing number %s found: %s', ret[1], line)
-                    raise ValidationError(_('More than one order line with ongoing numer %s found') % ret[1])
-
-                picking = move.picking_id
+            picking = move.picking_id
 
-                if not picking in pickings:
-                    pickings[picking] = []
-                pickings[picking].append((ret[1], ret[2], move, ret_cause))
+            if not picking in pickings:
+                pickings[picking] = []
+            pickings[picking].append((ret.line_code, ret.quantity, move, ret.cause))
         return pickings
 
     def make_return(self, picking, linenumbers):
@@ -639,9 +1007,9 @@ class StockPicking(models.Model):
         _logger.debug('Picking %s Move %s Returned qty %s', retpicking.name, newmove.name, newmove.quantity)
         return lineno
 
-    def process_return_orders(self, orders):
+    def process_return_orders(self, order_states):
         processed_lines = []
-        pickings = self.get_return_pickings(orders)
+        pickings = self.get_return_pickings(order_states)
 
         _logger.debug('Processing returns %s', len(pickings.keys()))
         for picking, linez in pickings.items():
@@ -698,9 +1066,9 @@ class StockPicking(models.Model):
         url, username, password, good_owner_code = self._get_ongoing_credential()
         if not username or not password or not good_owner_code:
             raise UserError(_('Credential Missing'))
-        request = OngoingRequest(self.log_xml, url, username, password, good_owner_code)
-        ongoing_response = request._prepare_get_orders_by_query(last_sync=company.last_return_sync_on)
-        if ongoing_response['response']:
+        request = self._get_ongoing_request()
+        order_states = request.parse_order_states(request.stream_orders(last_sync=company.last_return_sync_on))
+        if order_states:
             company.last_return_sync_on = fields.Datetime.now()
-            self.process_return_orders(ongoing_response['response'])
+            self.process_return_orders(order_states)
         return True
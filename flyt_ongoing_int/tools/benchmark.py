@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+""" End-to-end throughput benchmark of the Ongoing connector against the
+    local fake server (see fake_ongoing.py).
+
+    From an Odoo shell on a disposable database, with the module installed:
+
+        from odoo.addons.flyt_ongoing_int.tools.benchmark import run
+        run(env, sizes=(100, 1000, 10000), allow_commit=True, latency=0.02)
+
+    For every size N it creates N products, N confirmed purchase orders (in
+    orders) and N confirmed, reserved sale orders (out orders), then times
+    the crons exchanging them with the fake server. The out order dispatch
+    and the inbound sync commit while they run, which is why the benchmark
+    must be explicitly allowed to.
+"""
+
+import logging
+import time
+
+from odoo import fields, _
+from odoo.exceptions import UserError
+
+from .fake_ongoing import FakeOngoingServer
+
+_logger = logging.getLogger(__name__)
+
+
+def _run_jobs(env):
+    """ Run the Ongoing job worker until no job is due """
+    Job = env['ongoing.job']
+    while Job.search_count([('state', '=', 'pending'), ('next_try', '<=', fields.Datetime.now())]):
+        Job._cron_process()
+
+
+BENCHMARKS = (
+    ('send_to_ongoing', lambda Picking: Picking.send_to_ongoing()),
+    ('ongoing.job._cron_process', lambda Picking: _run_jobs(Picking.env)),
+    ('_cron_set_tracking_number', lambda Picking: Picking._cron_set_tracking_number()),
+    ('_cron_sync_inbound_order', lambda Picking: Picking._cron_sync_inbound_order()),
+    ('_cron_get_return_order', lambda Picking: Picking._cron_get_return_order()),
+)
+
+
+def _measure(env, name, size, function):
+    cr = env.cr
+    queries = cr.sql_log_count
+    started = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started
+    result = {
+        'name': name,
+        'size': size,
+        'seconds': elapsed,
+        'records_per_second': size / elapsed if elapsed else 0.0,
+        'queries': cr.sql_log_count - queries,
+    }
+    _logger.info('Ongoing benchmark: %(name)s on %(size)s records: %(seconds).2fs, '
+                 '%(records_per_second).1f records/s, %(queries)s queries', result)
+    return result
+
+
+def _create_data(env, size, tag):
+    """ size products in stock, size confirmed purchase orders and size
+        confirmed and reserved sale orders, one line each """
+    company = env.company
+    warehouse = env['stock.warehouse'].search([('company_id', '=', company.id)], limit=1)
+    vendor = env['res.partner'].create({'name': 'Benchmark vendor %s' % tag})
+    customer = env['res.partner'].create({
+        'name': 'Benchmark customer %s' % tag,
+        'street': 'Benchmark street 1',
+        'zip': '0150',
+        'city': 'Oslo',
+        'country_id': env.ref('base.no').id,
+        'email': 'benchmark@example.com',
+    })
+    products = env['product.product'].create([{
+        'name': 'Benchmark product %s-%s' % (tag, index),
+        'default_code': 'BENCH-%s-%s' % (tag, index),
+        'type': 'product',
+        'standard_price': 10.0,
+        'list_price': 20.0,
+    } for index in range(size)])
+    for product in products:
+        env['stock.quant']._update_available_quantity(product, warehouse.lot_stock_id, 100.0)
+
+    purchases = env['purchase.order'].create([{
+        'partner_id': vendor.id,
+        'order_line': [(0, 0, {'product_id': product.id, 'product_qty': 5.0, 'price_unit': 10.0})],
+    } for product in products])
+    purchases.button_confirm()
+
+    sales = env['sale.order'].create([{
+        'partner_id': customer.id,
+        'warehouse_id': warehouse.id,
+        'order_line': [(0, 0, {'product_id': product.id, 'product_uom_qty': 2.0})],
+    } for product in products])
+    sales.action_confirm()
+    sales.picking_ids.action_assign()
+    return sales, purchases
+
+
+def run(env, sizes=(100, 1000, 10000), allow_commit=False, **fake_options):
+    """ Run the benchmarks for each size
+        @param fake_options: FakeOngoing options (latency, error_rate, ...)
+        @return: list of dict with name, size, seconds, records_per_second, queries
+    """
+    if not allow_commit:
+        raise UserError(_('The Ongoing benchmark commits data: run it on a disposable database, '
+                          'with allow_commit=True.'))
+    fake_options.setdefault('return_rate', 0.1)
+    server = FakeOngoingServer(**fake_options).start()
+    company = env.company
+    company.write({
+        'activate_ongoing': True,
+        'ongoing_url': server.url,
+        'ongoing_username': 'benchmark',
+        'ongoing_password': 'benchmark',
+        'ongoing_good_owner_code': 'benchmark',
+        # The return poll only asks for returns once it has a last sync date
+        'last_return_sync_on': fields.Datetime.now(),
+    })
+    results = []
+    try:
+        for size in sizes:
+            tag = '%s-%s' % (size, int(time.time()))
+            results.append(_measure(env, 'create data', size, lambda: _create_data(env, size, tag)))
+            Picking = env['stock.picking']
+            for name, function in BENCHMARKS:
+                results.append(_measure(env, name, size, lambda: function(Picking)))
+            env.cr.commit()
+    finally:
+        server.stop()
+        _logger.info('Ongoing benchmark: fake server calls %s', server.fake.calls)
+
+    return results
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+""" Local stand-in for the Ongoing WMS SOAP service.
+
+    Serves api/ongoing.wsdl and answers the operations the connector uses,
+    with responses rendered from the WSDL schema, so the connector can be
+    exercised and measured without reaching Ongoing:
+
+        server = FakeOngoingServer(latency=0.05, error_rate=0.01).start()
+        company.ongoing_url = server.url
+        ...
+        server.stop()
+
+    Orders, in-orders and articles sent to it are kept in memory, so the
+    tracking, inbound and return polls answer about them.
+"""
+
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from lxml import etree
+from zeep.xsd.types import builtins
+
+from ..models.ongoing_envelope import EnvelopeBuilder, TNS
+from ..models.ongoing_wsdl import BUNDLED_WSDL, get_wsdl_document
+
+_logger = logging.getLogger(__name__)
+
+NS = '{%s}' % TNS
+SOAP_FAULT = b"""<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><soap:Fault>
+<faultcode>soap:Server</faultcode><faultstring>%s</faultstring>
+</soap:Fault></soap:Body></soap:Envelope>"""
+
+
+def _default_text(xmlvalue):
+    """ Text of a required element the fake has no value for """
+    xsd_type = xmlvalue.__self__
+    if isinstance(xsd_type, builtins.Boolean):
+        return 'false'
+    if isinstance(xsd_type, (builtins.Decimal, builtins.Float, builtins.Double)):
+        return '0'
+    if isinstance(xsd_type, (builtins.DateTime, builtins.Date)):
+        return xmlvalue(datetime.now())
+    return ''
+
+
+class ResponseBuilder(EnvelopeBuilder):
+    """ EnvelopeBuilder for response elements, filling the required
+        elements missing from the values with neutral defaults """
+
+    def _render_item(self, parent, name, qname, child, xmlvalue, optional, nillable, value):
+        if value is None and not optional and not nillable:
+            if child is None:
+                etree.SubElement(parent, qname).text = _default_text(xmlvalue)
+                return
+            value = {}
+        super()._render_item(parent, name, qname, child, xmlvalue, optional, nillable, value)
+
+
+class FakeOngoing():
+    """ In-memory Ongoing goods owner answering SOAP requests
+        @param latency: seconds each call waits before answering
+        @param jitter: extra random latency, up to this many seconds
+        @param error_rate: share of calls answered with a SOAP fault
+        @param pallet_items: pallet items (with tracking) per shipped order
+        @param extra_orders: unrelated orders added to each GetOrdersByQuery
+                             answer, to grow the response size
+        @param return_rate: share of orders reported as returned
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, pallet_items=1, extra_orders=0,
+                 return_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.pallet_items = pallet_items
+        self.extra_orders = extra_orders
+        self.return_rate = return_rate
+        self.random = random.Random(seed)
+        self.builder = ResponseBuilder(get_wsdl_document(BUNDLED_WSDL))
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1000)
+        self.articles = {}
+        self.in_orders = {}
+        self.orders = {}
+        self.calls = {}
+
+    def handle(self, operation, body):
+        """ Answer a SOAP request
+            @return: (HTTP status, response body)
+        """
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            failed = self.random.random() < self.error_rate
+            delay = self.latency + self.random.random() * self.jitter
+        if delay:
+            time.sleep(delay)
+        handler = getattr(self, '_op_%s' % operation, None)
+        if handler is None:
+            return 500, SOAP_FAULT % ('Operation %s is not implemented by the fake server' % operation).encode()
+        if failed:
+            return 500, SOAP_FAULT % b'Fake Ongoing error'
+        request = etree.fromstring(body).find('.//%s%s' % (NS, operation))
+        with self._lock:
+            result = handler(request)
+        envelope = self.builder.build(operation + 'Response', {operation + 'Result': result})
+        return 200, etree.tostring(envelope, xml_declaration=True, encoding='utf-8')
+
+    # --------------------------
+    # Operations
+    # --------------------------
+
+    def _text(self, node, name):
+        return node.findtext('.//%s%s' % (NS, name))
+
+    def _file_result(self, **values):
+        return dict({'Success': True, 'OrderId': 0, 'InOrderId': 0, 'ArticleDefId': 0}, **values)
+
+    def _op_ProcessArticle(self, request):
+        number = self._text(request, 'ArticleNumber')
+        article_id = self.articles.setdefault(number, next(self._ids))
+        return self._file_result(ArticleDefId=article_id, Message='Article %s saved' % number)
+
+    def _op_ProcessInOrder(self, request):
+        number = self._text(request, 'GoodsOwnerOrderNumber')
+        lines = [(self._text(line, 'ArticleNumber'), self._text(line, 'NumberOfItems'))
+                 for line in request.iter(NS + 'InOrderLine')]
+        in_order_id = next((key for key, in_order in self.in_orders.items() if in_order['number'] == number), None)
+        if in_order_id is None:
+            in_order_id = next(self._ids)
+        self.in_orders[in_order_id] = {'number': number, 'lines': lines, 'received': False}
+        return self._file_result(InOrderId=in_order_id, GoodsOwnerOrderNumber=number,
+                                 Message='In order %s saved' % number)
+
+    def _op_ProcessOrder(self, request):
+        number = self._text(request, 'GoodsOwnerOrderNumber')
+        lines = [{
+            'article': self._text(line, 'ArticleNumber'),
+            'quantity': self._text(line, 'NumberOfItems'),
+            'code': self._text(line, 'ExternalOrderLineCode'),
+            'system_id': next(self._ids),
+        } for line in request.iter(NS + 'CustomerOrderLine')]
+        order_id = next((key for key, order in self.orders.items() if order['number'] == number), None)
+        if order_id is None:
+            order_id = next(self._ids)
+        self.orders[order_id] = {
+            'number': number,
+            'lines': lines,
+            'returned': self.random.random() < self.return_rate,
+            # Orders are shipped as soon as they are received
+            'status_changed': datetime.utcnow(),
+        }
+        return self._file_result(OrderId=order_id, GoodsOwnerOrderNumber=number, Message='Order %s saved' % number)
+
+    def _article(self, number):
+        return {'ArticleNumber': number, 'Name': number, 'SystemId': self.articles.get(number)}
+
+    def _order(self, order_id, returns=False):
+        order = self.orders.get(order_id) or {'number': str(order_id), 'lines': [], 'returned': False}
+        values = {
+            'Success': True,
+            'OrderInfo': {
+                'OrderId': order_id,
+                'GoodsOwnerOrderNumber': order['number'],
+                'OrderStatusNumber': 450,
+                'OrderStatusText': 'Sendt',
+            },
+            'OrderPalletItems': {'OrderPalletItemInfo': [{
+                'Id': next(self._ids),
+                'LabelId': 'FAKE%010d' % order_id,
+                'NumberOfItems': 1,
+                'IsTaPalletItem': True,
+                'Tracking': {'TrackingUrl': 'https://tracking.invalid/%s/%s' % (order_id, index)},
+            } for index in range(self.pallet_items)]},
+            'PickedArticleItems': {'PickedArticleItem': [{
+                'Article': self._article(line['article']),
+                'ArticleItemId': next(self._ids),
+                'NumberOfItems': line['quantity'],
+                'OrderLineSystemId': line['system_id'],
+                'ExternalOrderLineCode': line['code'],
+            } for line in order['lines']]},
+        }
+        if returns:
+            values['PickedOrderLines'] = {'PickedOrderLine': [{
+                'Article': self._article(line['article']),
+                'OrderLineSystemId': line['system_id'],
+                'ExternalOrderLineCode': line['code'],
+                'OrderedNumberOfItems': line['quantity'],
+                'PickedNumberOfItems': line['quantity'],
+                'ReturnedNumberOfItems': line['quantity'],
+            } for line in order['lines']]}
+        return values
+
+    def _op_GetOrdersByQuery(self, request):
+        # Unset filters are sent as empty xsi:nil elements
+        returns = bool(self._text(request, 'LastReturnedFrom'))
+        changed_from = self._text(request, 'OrderStatusChangedTimeFrom')
+        if returns:
+            order_ids = [order_id for order_id, order in self.orders.items() if order['returned']]
+        elif changed_from:
+            changed_from = datetime.fromisoformat(changed_from)
+            order_ids = [order_id for order_id, order in self.orders.items()
+                         if order['status_changed'] >= changed_from]
+        else:
+            order_ids = [int(node.text) for node in request.iter(NS + 'int')]
+        orders = [self._order(order_id, returns) for order_id in order_ids]
+        orders += [self._order(next(self._ids)) for dummy in range(self.extra_orders)]
+        return {'Orders': {'Order': orders}}
+
+    def _op_GetOrder(self, request):
+        return self._order(int(self._text(request, 'OrderId')))
+
+    def _op_GetInboundTransactionsByQuery(self, request):
+        transactions = []
+        for in_order_id, in_order in self.in_orders.items():
+            if in_order['received']:
+                continue
+            in_order['received'] = True
+            transactions += [{
+                'Article': {'ArticleDefId': self.articles.get(article, 0), 'ArticleNumber': article},
+                'NumberOfItems': quantity,
+                'OriginalArticleItemId': next(self._ids),
+                'InOrder': {'InOrderId': in_order_id, 'InOrderNumber': in_order['number']},
+            } for article, quantity in in_order['lines']]
+        return {'Success': True, 'InboundTransactions': {'GoodsOwnerInboundTransaction': transactions}}
+
+    def _op_GetReturnOrdersByQuery(self, request):
+        return {'Success': True, 'ReturnOrders': {}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body, content_type='text/xml; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if 'wsdl' not in urlsplit(self.path).query.lower():
+            return self._reply(404, b'')
+        self._reply(200, self.server.wsdl)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        operation = (self.headers.get('SOAPAction') or '').strip('"').rsplit('/', 1)[-1]
+        self._reply(*self.server.fake.handle(operation, body))
+
+    def log_message(self, format, *args):
+        _logger.debug('Fake Ongoing: ' + format, *args)
+
+
+class FakeOngoingServer(ThreadingHTTPServer):
+    """ HTTP server of a FakeOngoing on a free local port, taking the
+        FakeOngoing options as keyword arguments """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        super().__init__((host, port), _Handler)
+        self.fake = FakeOngoing(**options)
+        with open(BUNDLED_WSDL, 'rb') as wsdl_file:
+            wsdl = wsdl_file.read()
+        self.wsdl = re.sub(rb'(<soap(?:12)?:address location=")[^"]*(")',
+                           rb'\g<1>' + self.address.encode() + rb'\2', wsdl)
+        self._thread = None
+
+    @property
+    def address(self):
+        return 'http://%s:%s/service.asmx' % self.server_address[:2]
+
+    @property
+    def url(self):
+        """ WSDL url, to be used as the company's Ongoing API url """
+        return self.address + '?WSDL'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake.ongoing', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()